@@ -0,0 +1,152 @@
+"""
+Optional DuckDB engine for the dashboard's aggregate queries.
+
+esg_index.db is attached read-only in an embedded, in-process DuckDB
+through DuckDB's sqlite extension. The extension scans the SQLite file
+directly, so there is no copy to keep in sync. The named aggregates in
+ENGINE_QUERIES then run on DuckDB's vectorized engine instead of
+SQLite's row-at-a-time executor. The SQL is the same text as in
+modules/queries.py; only the parameter style is translated.
+
+The engine is strictly optional and never downloads anything: the sqlite
+extension is loaded only if it is already installed. read_df() falls back
+to the SQLite version of the same named query in three cases:
+- duckdb is not installed;
+- the sqlite extension is not installed or cannot be loaded;
+- a query fails on DuckDB.
+Failures are remembered (not retried) and reported by status(). The result
+is therefore the same either way, only the speed differs.
+"""
+import re
+import threading
+
+try:
+    import duckdb
+except ImportError: # Valfritt beroende: utan duckdb körs allt i SQLite
+    duckdb = None
+
+from modules import db
+from modules import queries
+
+ATTACH_ALIAS = "esg"
+
+# Namngivna frågor (queries.QUERIES) som körs i DuckDB när motorn är igång
+ENGINE_QUERIES = (
+    "spend_summary",
+    "product_breakdown",
+    "water_totals",
+    "scope_category_totals",
+    "scope_category_totals_period",
+)
+
+_PARAM = re.compile(r"(?<![:\w]):(\w+)")
+
+_engine = None
+_engine_error = None # Orsak om motorn inte kunde startas (försöks inte igen)
+_engine_lock = threading.Lock()
+_local = threading.local()
+_failed_queries = {} # namn -> fel från DuckDB; frågan körs i SQLite framöver
+
+
+def engine_sql(name):
+    """Den namngivna frågans SQL för DuckDB (:namn -> $namn), None om den inte körs i motorn."""
+    if name not in ENGINE_QUERIES:
+        return None
+    return _PARAM.sub(r"$\1", queries.QUERIES[name])
+
+
+def _open_engine(db_path):
+    # Inga automatiska nedladdningar: tillägget måste redan vara installerat
+    engine = duckdb.connect(database=":memory:", config={"autoinstall_known_extensions": False})
+    try:
+        engine.execute("LOAD sqlite")
+        engine.execute(f"ATTACH '{db_path}' AS {ATTACH_ALIAS} (TYPE SQLITE, READ_ONLY)")
+        engine.execute(f"USE {ATTACH_ALIAS}") # Okvalificerade tabellnamn som i queries.QUERIES
+    except Exception:
+        engine.close()
+        raise
+    return engine
+
+
+def _get_engine():
+    global _engine, _engine_error
+    if duckdb is None:
+        return None
+    with _engine_lock:
+        if _engine is None and _engine_error is None:
+            try:
+                _engine = _open_engine(db.DB_PATH.replace("'", "''"))
+            except Exception as e:
+                _engine_error = str(e)
+        return _engine
+
+
+def _cursor():
+    # En DuckDB-anslutning får inte delas mellan trådar; varje tråd får sin egen cursor
+    engine = _get_engine()
+    if engine is None:
+        return None
+    cursor = getattr(_local, "cursor", None)
+    if cursor is None or getattr(_local, "engine", None) is not engine:
+        cursor = _local.cursor = engine.cursor()
+        _local.engine = engine
+    return cursor
+
+
+def available():
+    """True om DuckDB-motorn är igång (duckdb installerat och databasen bifogad)."""
+    return _get_engine() is not None
+
+
+def status():
+    """Kort beskrivning av vilken motor aggregaten körs i, inklusive frågor som fallit tillbaka på SQLite."""
+    if duckdb is None:
+        return "SQLite (duckdb är inte installerat)"
+    if not available():
+        return f"SQLite (DuckDB kunde inte starta: {_engine_error})"
+    text = f"DuckDB {duckdb.__version__}"
+    if _failed_queries:
+        text += "; i SQLite: " + ", ".join(f"{name} ({error})" for name, error in sorted(_failed_queries.items()))
+    return text
+
+
+def _engine_can_read(conn):
+    # Motorn har bara koncerndatabasen bifogad (inte bolagsfiler) och ser inte ej committade skrivningar
+    if conn is None:
+        return True
+    pool = getattr(conn, "_pool", None)
+    return not conn.in_transaction and pool is not None and pool.db_path == db.DB_PATH
+
+
+def read_df(name, params=None, conn=None):
+    """
+    Kör ett namngivet aggregat i DuckDB, med SQLite som reserv.
+    Args:
+        name (str): Nyckel i queries.QUERIES (i DuckDB om den finns i ENGINE_QUERIES).
+        params (dict, optional): Värden för frågans parametrar.
+        conn (optional): SQLite-anslutning för reservvägen. Mot en annan fil än
+            DB_PATH, eller med en öppen transaktion, körs frågan där.
+    Returns:
+        pd.DataFrame: Samma kolumner oavsett motor.
+    """
+    sql = engine_sql(name)
+    use_engine = sql is not None and name not in _failed_queries and _engine_can_read(conn)
+    cursor = _cursor() if use_engine else None
+    if cursor is not None:
+        try:
+            with queries.timed(f"duckdb:{name}"):
+                return cursor.execute(sql, params or {}).df()
+        except duckdb.Error as e:
+            # T.ex. blandade typer i en SQLite-kolumn; frågan körs i SQLite framöver
+            _failed_queries[name] = str(e)
+    return queries.read_df(name, params, conn)
+
+
+def reset():
+    """Stänger motorn så att nästa fråga bifogar databasen på nytt (t.ex. efter byte av fil)."""
+    global _engine, _engine_error
+    with _engine_lock:
+        if _engine is not None:
+            _engine.close()
+        _engine = _engine_error = None
+        _failed_queries.clear()
@@ -0,0 +1,136 @@
+"""
+Content-addressed cache for generated report files.
+
+An artifact is stored under a key derived from the report name, its
+parameters and a fingerprint of every source table (row count, max rowid
+and a trigger-maintained change counter). As long as none of the source
+tables change, the same request maps to the same file and is served from
+disk instead of being rebuilt. The cache directory is kept under a size
+limit by evicting the least recently used files.
+"""
+import hashlib
+import json
+import os
+import uuid
+
+from modules import db
+
+MAX_CACHE_BYTES = 256 * 1024 * 1024
+
+
+def cache_dir(db_path=None):
+    """Katalog för cachade rapportfiler, bredvid databasen."""
+    return os.path.join(os.path.dirname(os.path.abspath(db_path) if db_path else db.DB_PATH), "report_cache")
+
+
+def table_fingerprint(conn, tables):
+    """
+    Fingeravtryck per tabell. Läser bara; ändringsräknarna underhålls av
+    triggers som migreringen (migrations.MIGRATIONS, version 4) installerar.
+    Returns:
+        dict: {tabell: [antal rader, max rowid, ändringsräknare]} eller None om tabellen saknas.
+    """
+    try:
+        versions = dict(conn.execute("SELECT table_name, version FROM system_table_versions"))
+    except Exception:
+        versions = {} # Databasen är inte migrerad än
+    fingerprint = {}
+    for table in sorted(set(tables)):
+        try:
+            count, max_rowid = conn.execute(f"SELECT COUNT(*), MAX(rowid) FROM {table}").fetchone()
+        except Exception:
+            fingerprint[table] = None
+            continue
+        fingerprint[table] = [count, max_rowid, versions.get(table, 0)]
+    return fingerprint
+
+
+def artifact_key(conn, name, tables, params=None):
+    """Cachenyckel (sha256) för en rapport, dess parametrar och källtabellernas tillstånd."""
+    payload = json.dumps({
+        "name": name,
+        "params": params or {},
+        "tables": table_fingerprint(conn, tables),
+    }, sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def _path_for(key, suffix, db_path=None):
+    return os.path.join(cache_dir(db_path), key + suffix)
+
+
+def lookup(name, tables, params=None, suffix="", db_path=None):
+    """Sökvägen till en cachad artefakt, eller None om den saknas eller är inaktuell."""
+    with db.get_conn(db_path) as conn:
+        path = _path_for(artifact_key(conn, name, tables, params), suffix, db_path)
+    if not os.path.exists(path):
+        return None
+    os.utime(path) # Markera som senast använd (LRU)
+    return path
+
+
+def get_or_build(name, tables, build, params=None, suffix="", db_path=None):
+    """
+    Returnerar en cachad artefakt, eller bygger och cachar den.
+    Args:
+        name (str): Rapportens namn, t.ex. 'csrd_excel'.
+        tables (list): Tabeller som rapporten läser.
+        build (callable): build(path) skriver artefakten till path.
+        params (dict, optional): Rapportparametrar som ingår i nyckeln.
+        suffix (str): Filändelse, t.ex. '.xlsx'.
+        db_path (str, optional): Databasfilen (t.ex. i en arbetsprocess). Defaults to DB_PATH.
+    Returns:
+        str: Sökvägen till artefakten i cachen.
+    """
+    with db.get_conn(db_path) as conn:
+        path = _path_for(artifact_key(conn, name, tables, params), suffix, db_path)
+    if os.path.exists(path):
+        os.utime(path)
+        return path
+
+    os.makedirs(cache_dir(db_path), exist_ok=True)
+    tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+    try:
+        build(tmp_path)
+        os.replace(tmp_path, path) # Atomiskt: samtidiga läsare ser aldrig en halvskriven fil
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    evict(db_path=db_path)
+    return path
+
+
+def evict(max_bytes=None, db_path=None):
+    """
+    Tar bort de minst nyligen använda filerna tills cachen ryms i max_bytes.
+    Returns:
+        int: Antal borttagna filer.
+    """
+    max_bytes = MAX_CACHE_BYTES if max_bytes is None else max_bytes
+    directory = cache_dir(db_path)
+    if not os.path.isdir(directory):
+        return 0
+
+    entries = []
+    for entry in os.scandir(directory):
+        if entry.is_file() and not entry.name.endswith(".tmp"):
+            stat = entry.stat()
+            entries.append((stat.st_mtime, stat.st_size, entry.path))
+
+    total = sum(size for _, size, _ in entries)
+    removed = 0
+    for _, size, path in sorted(entries):
+        if total <= max_bytes:
+            break
+        try:
+            os.remove(path)
+        except OSError:
+            continue
+        total -= size
+        removed += 1
+    return removed
+
+
+def clear():
+    """Tömmer hela cachen."""
+    return evict(0)
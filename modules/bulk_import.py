@@ -0,0 +1,336 @@
+"""
+Bulk import of CSV/Excel files into the fact tables.
+
+Files are read in chunks, the columns are mapped onto the target table
+(accepting common header variants), values are validated and coerced per
+column type and emissions are computed vectorized for the whole chunk.
+Each chunk is written with one executemany() and the whole file is loaded
+in a single transaction, so a failed import leaves the table untouched.
+"""
+import time
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+from modules import change_log
+from modules import db
+from modules import scope1_calculator
+from modules import scope2_calculator
+from modules import scope3_pendling
+from modules import scope3_spend
+from modules.query_cache import invalidate
+
+CHUNK_SIZE = 10000
+MAX_ERROR_SAMPLES = 20
+
+
+def _drivmedel_emissions(df):
+    factors = df["drivmedelstyp"].map(scope1_calculator.EMISSION_FACTORS).fillna(scope1_calculator.DEFAULT_FACTOR)
+    df["co2_kg"] = df["volym_liter"] * factors
+    return df
+
+
+def _energi_emissions(df):
+    # Faktorfunktionerna anropas en gång per distinkt år/elkälla, inte per rad
+    grid = {ar: scope2_calculator.get_grid_mix_factor(ar) for ar in df["ar"].unique()}
+    market = {src: scope2_calculator.get_market_based_factor(src) for src in df["el_kalla"].unique()}
+    # Tom fjärrvärmecell = ingen fjärrvärme (lagras som 0 så att omräkningen ger samma värde)
+    df["fjarrvarme_kwh"] = df["fjarrvarme_kwh"].fillna(0.0)
+    heat = df["fjarrvarme_kwh"] * scope2_calculator.DISTRICT_HEATING_FACTOR
+    df["scope2_location_based_kg"] = df["el_kwh"] * df["ar"].map(grid) + heat
+    df["scope2_market_based_kg"] = df["el_kwh"] * df["el_kalla"].map(market) + heat
+    return df
+
+
+def _spend_emissions(df):
+    df["emission_factor"] = df["category"].map(scope3_spend.EMISSION_FACTORS).fillna(0.010)
+    df["co2e_tonnes"] = df["spend_sek"] * df["emission_factor"] / 1000.0
+    df["data_quality"] = df["data_quality"].fillna("Estimated")
+    df["created_date"] = datetime.now().strftime('%Y-%m-%d')
+    return df
+
+
+def _water_consumption(df):
+    df["consumption_m3"] = df["consumption_m3"].fillna(df["withdrawal_m3"].fillna(0) - df["discharge_m3"].fillna(0))
+    return df
+
+
+def _calculate_commutes(conn):
+    # Beräknar pendling för de nya uppdragen (samma motor som översikten använder)
+    return scope3_pendling.calculate_all_consultants(conn)
+
+
+# Måltabell -> spec:
+#   columns  - (kolumn, typ, alternativa rubriker); typ: 'date', 'int', 'float', 'text'
+#   required - kolumner som måste ha ett giltigt värde, annars avvisas raden
+#   compute  - vektoriserad beräkning av härledda kolumner (per block)
+#   derived  - kolumner som compute fyller i (skrivs även om de saknas i filen)
+#   after    - körs en gång när filen är inläst och committad
+#   key      - naturlig nyckel (t.ex. år); befintliga rader uppdateras med filens kolumner
+IMPORT_TARGETS = {
+    'f_Drivmedel': {
+        'columns': [
+            ('datum', 'date', ['date', 'datum', 'tankdatum']),
+            ('volym_liter', 'float', ['volym', 'liter', 'volume', 'volume_liters']),
+            ('drivmedelstyp', 'text', ['drivmedel', 'fuel', 'fuel_type', 'typ']),
+            ('kvitto_ref', 'text', ['kvitto', 'receipt', 'ref']),
+        ],
+        'required': ['datum', 'volym_liter', 'drivmedelstyp'],
+        'compute': _drivmedel_emissions,
+        'derived': ['co2_kg'],
+    },
+    'f_Energi': {
+        'columns': [
+            ('ar', 'int', ['år', 'year']),
+            ('manad', 'int', ['månad', 'month']),
+            ('anlaggning_id', 'text', ['anläggning', 'anlaggning', 'site', 'site_id']),
+            ('el_kwh', 'float', ['el', 'electricity_kwh', 'kwh']),
+            ('fjarrvarme_kwh', 'float', ['fjärrvärme_kwh', 'fjärrvärme', 'district_heating_kwh']),
+            ('el_kalla', 'text', ['elkälla', 'el_källa', 'source', 'electricity_source']),
+        ],
+        'required': ['ar', 'el_kwh'],
+        'compute': _energi_emissions,
+        'derived': ['fjarrvarme_kwh', 'scope2_location_based_kg', 'scope2_market_based_kg'],
+    },
+    'f_Uppdrag': {
+        'columns': [
+            ('person_id', 'int', ['person', 'konsult_id']),
+            ('kund_plats_id', 'int', ['kund_plats', 'kundsite_id', 'site_id']),
+            ('startdatum', 'date', ['start', 'start_date', 'från']),
+            ('slutdatum', 'date', ['slut', 'end_date', 'till']),
+            ('dagar_per_vecka', 'float', ['dagar', 'days_per_week']),
+            ('distans_km', 'float', ['distans', 'distance_km', 'km']),
+            ('fardmedel', 'text', ['färdmedel', 'transport', 'mode']),
+        ],
+        'required': ['person_id', 'kund_plats_id', 'startdatum'],
+        'after': _calculate_commutes,
+    },
+    'f_Scope3_Calculations': {
+        'columns': [
+            ('category', 'text', ['kategori']),
+            ('subcategory', 'text', ['underkategori']),
+            ('product_name', 'text', ['produkt', 'product']),
+            ('spend_sek', 'float', ['belopp', 'belopp_sek', 'amount_sek', 'spend']),
+            ('reporting_period', 'text', ['period', 'år', 'year']),
+            ('data_quality', 'text', ['datakvalitet', 'quality']),
+            ('source_document', 'text', ['källa', 'underlag', 'source']),
+        ],
+        'required': ['category', 'spend_sek', 'reporting_period'],
+        'compute': _spend_emissions,
+        'derived': ['data_quality', 'emission_factor', 'co2e_tonnes', 'created_date'],
+    },
+    'f_HR_Arsdata': {
+        'columns': [
+            ('ar', 'int', ['år', 'year']),
+            ('enps_intern', 'int', ['enps']),
+            ('cnps_konsult', 'int', ['cnps']),
+            ('antal_interna', 'int', ['interna']),
+            ('antal_konsulter', 'int', ['konsulter']),
+            ('nyanstallda_ar', 'int', ['nyanställda']),
+            ('sjukfranvaro_procent', 'float', ['sjukfrånvaro', 'sjukfrånvaro_procent']),
+            ('arbetsolyckor_antal', 'int', ['arbetsolyckor']),
+            ('allvarliga_olyckor', 'int', []),
+            ('ledning_kvinnor', 'int', []),
+            ('ledning_man', 'int', ['ledning_män']),
+            ('inspirerade_barn_antal', 'int', []),
+            ('utbildning_timmar_snitt', 'float', ['utbildning_timmar']),
+        ],
+        'required': ['ar'],
+        'key': 'ar',
+    },
+    'f_Water_Data': {
+        'columns': [
+            ('date', 'date', ['datum']),
+            ('site_id', 'int', ['anläggning', 'site']),
+            ('withdrawal_m3', 'float', ['uttag_m3', 'withdrawal']),
+            ('withdrawal_source', 'text', ['källa', 'source']),
+            ('discharge_m3', 'float', ['utsläpp_m3', 'discharge']),
+            ('discharge_dest', 'text', ['recipient', 'destination']),
+            ('consumption_m3', 'float', ['förbrukning_m3', 'consumption']),
+            ('recycled_m3', 'float', ['återvunnet_m3', 'recycled']),
+        ],
+        'required': ['date', 'withdrawal_m3'],
+        'compute': _water_consumption,
+        'derived': ['consumption_m3'],
+    },
+    'f_Waste_Detailed': {
+        'columns': [
+            ('date', 'date', ['datum']),
+            ('waste_category', 'text', ['kategori', 'avfallstyp', 'category']),
+            ('is_hazardous', 'int', ['farligt', 'hazardous']),
+            ('weight_kg', 'float', ['vikt_kg', 'vikt', 'weight']),
+            ('treatment_method', 'text', ['behandling', 'method']),
+            ('supplier', 'text', ['leverantör', 'leverantor']),
+        ],
+        'required': ['date', 'waste_category', 'weight_kg'],
+    },
+}
+
+
+def _normalize_header(name):
+    return str(name).strip().lower().replace(" ", "_").replace("-", "_")
+
+
+def map_columns(headers, table):
+    """
+    Matchar filens rubriker mot måltabellens kolumner.
+    Returns:
+        dict: {rubrik i filen: kolumn i tabellen}.
+    Raises:
+        ValueError: Om obligatoriska kolumner saknas.
+    """
+    spec = IMPORT_TARGETS[table]
+    lookup = {}
+    for column, _, aliases in spec['columns']:
+        for alias in [column] + aliases:
+            lookup.setdefault(_normalize_header(alias), column)
+
+    mapping = {}
+    for header in headers:
+        column = lookup.get(_normalize_header(header))
+        if column is not None and column not in mapping.values():
+            mapping[header] = column
+
+    missing = [c for c in spec['required'] if c not in mapping.values()]
+    if missing:
+        raise ValueError(f"Obligatoriska kolumner saknas i filen: {', '.join(missing)}")
+    return mapping
+
+
+def _coerce(series, kind):
+    if kind == 'date':
+        return pd.to_datetime(series, errors='coerce').dt.strftime('%Y-%m-%d')
+    if kind in ('int', 'float'):
+        values = pd.to_numeric(series, errors='coerce')
+        return values.round().astype('Int64') if kind == 'int' else values.astype(float)
+    values = series.astype(object).where(series.notna(), None)
+    return values.map(lambda v: v if v is None else str(v).strip() or None)
+
+
+def prepare_chunk(chunk, table, mapping, first_row=0):
+    """
+    Mappar, validerar och beräknar ett block.
+    Args:
+        first_row (int): Radnummer (0-baserat, exkl. rubrik) för blockets första rad.
+    Returns:
+        tuple: (DataFrame med tabellens kolumner, lista med (radnummer, fel)).
+    """
+    spec = IMPORT_TARGETS[table]
+    df = pd.DataFrame(index=range(len(chunk)))
+    source = chunk.rename(columns=mapping).reset_index(drop=True)
+
+    for column, kind, _ in spec['columns']:
+        raw = source[column] if column in source.columns else pd.Series([None] * len(chunk), dtype=object)
+        df[column] = _coerce(raw, kind)
+
+    invalid = np.zeros(len(df), dtype=bool)
+    errors = []
+    for column in spec['required']:
+        bad = df[column].isna().to_numpy()
+        for i in np.flatnonzero(bad & ~invalid)[:MAX_ERROR_SAMPLES]:
+            errors.append((first_row + int(i) + 2, f"Ogiltigt eller saknat värde i '{column}'")) # +2: rubrikrad, 1-baserat
+        invalid |= bad
+
+    errors.sort()
+    df = df[~invalid].reset_index(drop=True)
+    if 'compute' in spec and not df.empty:
+        df = spec['compute'](df)
+    return df, errors, int(invalid.sum())
+
+
+def _insert_statement(table, mapping):
+    """
+    INSERT för filens kolumner plus de härledda; kolumner som saknas i filen
+    får tabellens standardvärden. Tabeller med naturlig nyckel uppdateras
+    (bara filens kolumner) om raden redan finns.
+    """
+    spec = IMPORT_TARGETS[table]
+    present = set(mapping.values()) | set(spec.get('derived', []))
+    columns = [c for c, _, _ in spec['columns'] if c in present]
+    columns += [c for c in spec.get('derived', []) if c not in columns]
+
+    sql = f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({', '.join('?' for _ in columns)})"
+    if 'key' in spec:
+        updates = ", ".join(f"{c} = excluded.{c}" for c in columns if c != spec['key'])
+        sql += f" ON CONFLICT({spec['key']}) DO " + (f"UPDATE SET {updates}" if updates else "NOTHING")
+    return columns, sql
+
+
+def _iter_chunks(source, chunk_size, sep=","):
+    """Läser en CSV- eller Excel-fil (sökväg eller filobjekt) i block om chunk_size rader."""
+    name = getattr(source, "name", source if isinstance(source, str) else "")
+    if str(name).lower().endswith((".xlsx", ".xlsm")):
+        from openpyxl import load_workbook
+        workbook = load_workbook(source, read_only=True, data_only=True)
+        try:
+            rows = workbook.active.iter_rows(values_only=True)
+            headers = next(rows, None)
+            if headers is None:
+                return
+            block = []
+            for row in rows:
+                block.append(row)
+                if len(block) >= chunk_size:
+                    yield pd.DataFrame(block, columns=headers)
+                    block = []
+            if block:
+                yield pd.DataFrame(block, columns=headers)
+        finally:
+            workbook.close()
+    else:
+        yield from pd.read_csv(source, chunksize=chunk_size, sep=sep, dtype=str, keep_default_na=True)
+
+
+def import_file(source, table, chunk_size=CHUNK_SIZE, sep=",", db_path=None):
+    """
+    Importerar en CSV/XLSX-fil till en faktatabell i en transaktion.
+    Args:
+        source (str|file): Sökväg eller filobjekt (t.ex. från st.file_uploader).
+        table (str): Måltabell, nyckel i IMPORT_TARGETS.
+        chunk_size (int): Rader per block.
+        sep (str): Kolumnavgränsare för CSV.
+        db_path (str, optional): Annan databasfil. Defaults to DB_PATH.
+    Returns:
+        dict: rows_read, rows_loaded, rows_rejected, errors (exempel),
+            seconds och rows_per_sec.
+    Raises:
+        ValueError: Okänd tabell eller obligatoriska kolumner saknas.
+    """
+    if table not in IMPORT_TARGETS:
+        raise ValueError(f"Import stöds inte för tabellen {table}")
+    spec = IMPORT_TARGETS[table]
+    started = time.perf_counter()
+    result = {"table": table, "rows_read": 0, "rows_loaded": 0, "rows_rejected": 0, "errors": []}
+    mapping = sql = None
+
+    with db.get_conn(db_path) as conn:
+        try:
+            for chunk in _iter_chunks(source, chunk_size, sep):
+                if mapping is None:
+                    mapping = map_columns(chunk.columns, table)
+                    columns, sql = _insert_statement(table, mapping)
+                df, errors, rejected = prepare_chunk(chunk, table, mapping, result["rows_read"])
+                result["rows_read"] += len(chunk)
+                result["rows_rejected"] += rejected
+                result["errors"].extend(errors[:MAX_ERROR_SAMPLES - len(result["errors"])])
+
+                if not df.empty:
+                    # None i stället för NaN/<NA> så att sqlite skriver NULL
+                    values = df[columns].astype(object).where(df[columns].notna(), None)
+                    conn.executemany(sql, values.itertuples(index=False, name=None))
+                    result["rows_loaded"] += len(df)
+
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+
+        if 'after' in spec and result["rows_loaded"]:
+            spec['after'](conn)
+
+    invalidate(table)
+    change_log.process_changes_async(db_path)
+    result["seconds"] = round(time.perf_counter() - started, 3)
+    result["rows_per_sec"] = round(result["rows_loaded"] / result["seconds"]) if result["seconds"] else result["rows_loaded"]
+    return result
@@ -0,0 +1,273 @@
+"""
+Trigger-based change tracking and incremental recalculation.
+
+Triggers on the fact tables write the key of every inserted, edited or
+deleted row to system_change_log. process_changes() then recomputes only
+those rows (and the derived tables they feed) instead of rewriting whole
+tables with recalculate_all().
+
+Recalculation can need network calls (commute distances), so it never runs
+while a page renders. Write paths call process_changes_async(), which runs
+it in a background thread; pages only read pending_changes() and last_error().
+"""
+import os
+import threading
+
+from modules import db
+from modules import migrations
+from modules import scope1_calculator
+from modules import scope2_calculator
+from modules import scope3_pendling
+from modules import scope3_spend
+from modules import scope3_travel
+from modules import scope3_waste
+from modules import scope3_purchased_goods
+
+# Tabell -> (nyckelkolumn, indatakolumner). UPDATE-triggern lyssnar bara på
+# indatakolumnerna, så omräkningens egna skrivningar (co2 m.m.) loggas inte.
+TRACKED_TABLES = {
+    'f_Drivmedel': ('id', ['datum', 'volym_liter', 'drivmedelstyp']),
+    'f_Energi': ('id', ['ar', 'manad', 'anlaggning_id', 'el_kwh', 'fjarrvarme_kwh', 'el_kalla']),
+    'f_Uppdrag': ('uppdrag_id', ['person_id', 'kund_plats_id', 'startdatum', 'slutdatum',
+                                 'dagar_per_vecka', 'distans_km', 'fardmedel']),
+    'f_Scope3_Calculations': ('id', ['category', 'spend_sek', 'emission_factor', 'reporting_period']),
+    'f_Scope3_BusinessTravel': ('id', ['date', 'travel_type', 'distance_km', 'fuel_type', 'class_type']),
+    'f_Scope3_Waste': ('id', ['date', 'waste_type', 'weight_kg', 'disposal_method']),
+    'f_Scope3_PurchasedGoodsServices': ('id', ['date', 'category', 'amount_sek']),
+}
+
+
+def ensure_change_tracking(conn):
+    """Skapar system_change_log och triggers (idempotent, hoppas över om schemat är aktuellt)."""
+    if migrations.is_current(conn):
+        return
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS system_change_log (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            table_name TEXT NOT NULL,
+            row_id INTEGER,
+            op TEXT,
+            changed_at TEXT DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+    for table, (key, columns) in TRACKED_TABLES.items():
+        conn.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS trg_{table}_log_ins AFTER INSERT ON {table}
+            BEGIN
+                INSERT INTO system_change_log (table_name, row_id, op) VALUES ('{table}', NEW.{key}, 'I');
+            END
+        """)
+        conn.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS trg_{table}_log_upd AFTER UPDATE OF {', '.join(columns)} ON {table}
+            BEGIN
+                INSERT INTO system_change_log (table_name, row_id, op) VALUES ('{table}', NEW.{key}, 'U');
+            END
+        """)
+        conn.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS trg_{table}_log_del AFTER DELETE ON {table}
+            BEGIN
+                INSERT INTO system_change_log (table_name, row_id, op) VALUES ('{table}', OLD.{key}, 'D');
+            END
+        """)
+
+    # Nytt hem-/kundpostnummer ändrar distansen för alla berörda uppdrag
+    conn.execute("""
+        CREATE TRIGGER IF NOT EXISTS trg_d_Personal_log_upd AFTER UPDATE OF hem_postnummer ON d_Personal
+        BEGIN
+            INSERT INTO system_change_log (table_name, row_id, op)
+            SELECT 'f_Uppdrag', uppdrag_id, 'U' FROM f_Uppdrag WHERE person_id = NEW.person_id;
+        END
+    """)
+    conn.execute("""
+        CREATE TRIGGER IF NOT EXISTS trg_d_Kundsiter_log_upd AFTER UPDATE OF postnummer ON d_Kundsiter
+        BEGIN
+            INSERT INTO system_change_log (table_name, row_id, op)
+            SELECT 'f_Uppdrag', uppdrag_id, 'U' FROM f_Uppdrag WHERE kund_plats_id = NEW.kund_plats_id;
+        END
+    """)
+    conn.commit()
+
+
+def get_dirty_rows(conn, watermark=None):
+    """
+    Ändrade rader per tabell enligt change log.
+    Returns:
+        dict: {tabell: (levande_id, borttagna_id)} där en rad räknas som
+            borttagen om den senaste loggade operationen är 'D'.
+    """
+    sql = "SELECT table_name, row_id, op FROM system_change_log"
+    params = ()
+    if watermark is not None:
+        sql += " WHERE id <= ?"
+        params = (watermark,)
+
+    last_op = {}
+    for table, row_id, op in conn.execute(sql + " ORDER BY id", params):
+        last_op[(table, row_id)] = op
+
+    dirty = {}
+    for (table, row_id), op in last_op.items():
+        live, deleted = dirty.setdefault(table, (set(), set()))
+        (deleted if op == 'D' else live).add(row_id)
+    return dirty
+
+
+def _recalculate_scope3_rows(conn, table, ids):
+    """Räknar om co2 för ändrade Scope 3-rader med respektive moduls faktorer."""
+    if not ids:
+        return
+    db.load_temp_table(conn, "tmp_dirty_ids", ["id INTEGER PRIMARY KEY"], [(i,) for i in ids])
+    where = "WHERE id IN (SELECT id FROM temp.tmp_dirty_ids)"
+
+    if table == 'f_Scope3_Calculations':
+        rows = conn.execute(f"SELECT id, category, spend_sek, emission_factor FROM {table} {where}").fetchall()
+        updates, derived = [], []
+        for row_id, category, spend, factor in rows:
+            # Radens egen faktor gäller; kategorifaktorn om den saknas (t.ex. nollställd
+            # av triggern när kategorin ändrats) och då sparas den också på raden
+            if factor is None:
+                factor = scope3_spend.EMISSION_FACTORS.get(category, 0.010)
+                derived.append(((spend or 0) * factor / 1000.0, factor, row_id))
+            else:
+                updates.append(((spend or 0) * factor / 1000.0, row_id))
+        conn.executemany(f"UPDATE {table} SET co2e_tonnes = ? WHERE id = ?", updates)
+        # Skrivningen av faktorn loggas av UPDATE-triggern; nästa körning räknar
+        # om raden en gång till med den sparade faktorn och loggar då inget
+        conn.executemany(f"UPDATE {table} SET co2e_tonnes = ?, emission_factor = ? WHERE id = ?", derived)
+
+    elif table == 'f_Scope3_BusinessTravel':
+        rows = conn.execute(f"SELECT id, travel_type, distance_km, fuel_type, class_type FROM {table} {where}").fetchall()
+        conn.executemany(f"UPDATE {table} SET co2_kg = ? WHERE id = ?", [
+            (scope3_travel.calculate_business_travel_emissions(t, d or 0, f, c or 'Economy'), row_id)
+            for row_id, t, d, f, c in rows
+        ])
+
+    elif table == 'f_Scope3_Waste':
+        rows = conn.execute(f"SELECT id, waste_type, weight_kg, disposal_method FROM {table} {where}").fetchall()
+        conn.executemany(f"UPDATE {table} SET co2_kg = ? WHERE id = ?", [
+            (scope3_waste.calculate_waste_emissions(t, w or 0, m), row_id)
+            for row_id, t, w, m in rows
+        ])
+
+    elif table == 'f_Scope3_PurchasedGoodsServices':
+        rows = conn.execute(f"SELECT id, category, amount_sek FROM {table} {where}").fetchall()
+        conn.executemany(f"UPDATE {table} SET co2_kg = ? WHERE id = ?", [
+            (scope3_purchased_goods.calculate_purchased_goods_emissions(c, a or 0), row_id)
+            for row_id, c, a in rows
+        ])
+
+
+def process_changes(conn):
+    """
+    Räknar om allt som ändrats sedan förra körningen och tömmer loggen.
+
+    Omräkningen är idempotent: loggposterna tas bara bort för tabeller som
+    räknats om, så det som misslyckas räknas om nästa gång.
+    Returns:
+        dict: Antal behandlade rader per tabell (tom om inget ändrats).
+    Raises:
+        RuntimeError: Om en tabell inte kunde räknas om; övriga tabeller är
+            då redan omräknade och deras loggposter borttagna.
+    """
+    ensure_change_tracking(conn)
+    watermark = conn.execute("SELECT MAX(id) FROM system_change_log").fetchone()[0]
+    if watermark is None:
+        return {}
+
+    dirty = get_dirty_rows(conn, watermark)
+    failed = {}
+
+    if 'f_Drivmedel' in dirty and dirty['f_Drivmedel'][0]:
+        scope1_calculator.recalculate_rows(conn, dirty['f_Drivmedel'][0])
+
+    if 'f_Energi' in dirty and dirty['f_Energi'][0]:
+        scope2_calculator.recalculate_rows(conn, dirty['f_Energi'][0])
+
+    if 'f_Uppdrag' in dirty:
+        conn.commit() # Scope 1/2 ska inte följa med om pendlingen rullas tillbaka
+        # Ta bort gamla beräkningar; calculate_all_consultants räknar sedan
+        # alla uppdrag som saknar beräkning, dvs. nya och ändrade. Borttagning
+        # och nya rader committas tillsammans, så ett fel lämnar allt orört.
+        live, deleted = dirty['f_Uppdrag']
+        conn.executemany("DELETE FROM f_Pendling_Beraknad WHERE uppdrag_id = ?", [(i,) for i in live | deleted])
+        try:
+            result = scope3_pendling.calculate_all_consultants(conn) if live else {}
+        except Exception as e: # T.ex. distansuppslag som inte går att göra
+            result = {'error': str(e)}
+        if 'error' in result:
+            conn.rollback()
+            failed['f_Uppdrag'] = result['error']
+        else:
+            conn.commit()
+
+    for table in ('f_Scope3_Calculations', 'f_Scope3_BusinessTravel',
+                  'f_Scope3_Waste', 'f_Scope3_PurchasedGoodsServices'):
+        if table in dirty:
+            _recalculate_scope3_rows(conn, table, dirty[table][0])
+
+    # Loggposter för tabeller som misslyckades behålls till nästa körning
+    placeholders = ", ".join("?" for _ in failed)
+    conn.execute(
+        f"DELETE FROM system_change_log WHERE id <= ? AND table_name NOT IN ({placeholders})",
+        (watermark, *failed),
+    )
+    conn.commit()
+
+    if failed:
+        raise RuntimeError("Omräkningen misslyckades: " + "; ".join(f"{table}: {error}" for table, error in failed.items()))
+    return {table: len(live) + len(deleted) for table, (live, deleted) in dirty.items()}
+
+
+# Databasfil -> bakgrundstråd som kör process_changes(); en per fil
+_runs = {}
+_rerun = set() # Filer som ändrats under en pågående körning
+_errors = {} # Databasfil -> fel från senaste bakgrundskörningen
+_runs_lock = threading.Lock()
+
+
+def _db_key(db_path):
+    return os.path.abspath(db_path) if db_path else db.DB_PATH
+
+
+def _process_in_background(path):
+    while True:
+        try:
+            with db.get_conn(path) as conn:
+                process_changes(conn)
+            _errors.pop(path, None)
+        except Exception as e:
+            _errors[path] = str(e)
+        with _runs_lock:
+            if path not in _rerun:
+                del _runs[path]
+                return
+            _rerun.discard(path)
+
+
+def process_changes_async(db_path=None):
+    """
+    Kör process_changes() i en bakgrundstråd. Pågår redan en körning för
+    filen körs den en gång till när den är klar, så inga ändringar missas.
+    Args:
+        db_path (str, optional): Annan databasfil (t.ex. ett bolag). Defaults to DB_PATH.
+    """
+    path = _db_key(db_path)
+    with _runs_lock:
+        if path in _runs:
+            _rerun.add(path)
+            return
+        thread = _runs[path] = threading.Thread(target=_process_in_background, args=(path,), daemon=True)
+    thread.start()
+
+
+def pending_changes(conn):
+    """Antal loggposter som väntar på omräkning (0 om loggen inte finns än)."""
+    try:
+        return conn.execute("SELECT COUNT(*) FROM system_change_log").fetchone()[0]
+    except Exception:
+        return 0
+
+
+def last_error(db_path=None):
+    """Felet från senaste bakgrundskörningen för filen, None om den lyckades."""
+    return _errors.get(_db_key(db_path))
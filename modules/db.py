@@ -0,0 +1,281 @@
+"""
+Shared SQLite access layer for the ESG tool.
+
+All modules get their connections from here instead of calling
+sqlite3.connect() themselves. The database path is resolved once per
+process and connections are pooled, so a Streamlit rerun reuses an already
+configured connection (WAL, pragmas, parsed schema) instead of opening a new
+one for every query.
+"""
+import os
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+DEFAULT_DB_PATH = os.path.join("database", "esg_index.db")
+
+# Pragmas applied once per physical connection
+CONNECTION_PRAGMAS = (
+    "PRAGMA synchronous = NORMAL",
+    "PRAGMA cache_size = -64000",      # ~64 MB page cache
+    "PRAGMA mmap_size = 268435456",    # 256 MB memory-mapped I/O
+    "PRAGMA temp_store = MEMORY",
+    "PRAGMA busy_timeout = 5000",
+)
+
+MAX_IDLE_CONNECTIONS = 8
+
+# Prepared statements kept per connection (sqlite3 default is 128). Named
+# queries (modules/queries.py) have fixed SQL text, so they stay compiled.
+CACHED_STATEMENTS = 256
+
+
+def _resolve_db_path():
+    """Finds esg_index.db from the CWD, its parent or the repo root."""
+    env_path = os.environ.get("ESG_DB_PATH")
+    if env_path:
+        return os.path.abspath(env_path)
+
+    repo_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    candidates = [
+        DEFAULT_DB_PATH,
+        os.path.join("..", DEFAULT_DB_PATH),
+        os.path.join(repo_root, DEFAULT_DB_PATH),
+    ]
+    for path in candidates:
+        if os.path.exists(path):
+            return os.path.abspath(path)
+    return os.path.abspath(DEFAULT_DB_PATH)
+
+
+DB_PATH = _resolve_db_path()
+
+
+class UnitRolledBack(sqlite3.OperationalError):
+    """A helper called rollback() inside unit_of_work(); nothing in the unit was committed."""
+
+
+class PooledConnection(sqlite3.Connection):
+    """
+    sqlite3.Connection that goes back to its pool instead of closing.
+
+    `with conn:` keeps the normal sqlite3 semantics (commit on success,
+    rollback on error) and then releases the connection. Only the outermost
+    holder on the thread commits or rolls back; a nested `with get_conn()`
+    just releases, so it never ends its caller's transaction. close() also
+    releases; use ConnectionPool.close_all() to really close connections.
+    Inside unit_of_work() commits are deferred to the end of the unit, and
+    a rollback() makes the unit rollback-only.
+    """
+
+    _pool = None
+    _deferred = 0
+    _rollback_only = False
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        try:
+            if self._deferred or self._pool.depth(self) > 1:
+                return False # Den yttersta innehavaren avgör commit/rollback
+            return super().__exit__(exc_type, exc_value, traceback)
+        finally:
+            self._pool.release(self)
+
+    def commit(self):
+        if self._deferred:
+            return
+        super().commit()
+
+    def rollback(self):
+        super().rollback()
+        if self._deferred:
+            # Enhetens tidigare skrivningar är redan borta; resten får inte committas
+            self._rollback_only = True
+
+    def close(self):
+        self._pool.release(self)
+
+
+class ConnectionPool:
+    """
+    Thread-aware pool of configured connections to one database file.
+
+    A thread that already holds a connection gets the same one back on
+    nested get() calls; the connection returns to the idle list when the
+    outermost holder releases it. Connections are opened with
+    check_same_thread=False so idle ones can be handed to any thread.
+    """
+
+    def __init__(self, db_path, max_idle=MAX_IDLE_CONNECTIONS):
+        self.db_path = db_path
+        self.max_idle = max_idle
+        self._idle = []
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._wal_checked = False
+
+    def _connect(self):
+        conn = sqlite3.connect(
+            self.db_path,
+            factory=PooledConnection,
+            check_same_thread=False,
+            cached_statements=CACHED_STATEMENTS,
+        )
+        conn._pool = self
+        if not self._wal_checked:
+            # journal_mode is persistent in the file, only needs setting once
+            conn.execute("PRAGMA journal_mode = WAL")
+            self._wal_checked = True
+        for pragma in CONNECTION_PRAGMAS:
+            conn.execute(pragma)
+        return conn
+
+    def get(self):
+        """
+        Returns a connection for the current thread.
+        Returns:
+            PooledConnection: Reused if this thread already holds one.
+        """
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            self._local.depth += 1
+            return conn
+
+        with self._lock:
+            conn = self._idle.pop() if self._idle else None
+        if conn is None:
+            conn = self._connect()
+
+        self._local.conn = conn
+        self._local.depth = 1
+        return conn
+
+    def depth(self, conn):
+        """Number of open holders of conn on the current thread (0 if it is not this thread's)."""
+        if getattr(self._local, "conn", None) is not conn:
+            return 0
+        return self._local.depth
+
+    def release(self, conn):
+        """Hands a connection back; the outermost release returns it to the pool."""
+        if getattr(self._local, "conn", None) is not conn:
+            return
+        self._local.depth -= 1
+        if self._local.depth > 0:
+            return
+
+        self._local.conn = None
+        if conn.in_transaction:
+            # Same outcome as closing a plain connection without commit()
+            conn.rollback()
+        with self._lock:
+            if len(self._idle) < self.max_idle:
+                self._idle.append(conn)
+                return
+        sqlite3.Connection.close(conn)
+
+    def close_all(self):
+        """Closes all idle connections (e.g. before replacing the db file)."""
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for conn in idle:
+            sqlite3.Connection.close(conn)
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(db_path=None):
+    """Returns the (process-wide) pool for a database file."""
+    path = os.path.abspath(db_path) if db_path else DB_PATH
+    with _pools_lock:
+        pool = _pools.get(path)
+        if pool is None:
+            pool = _pools[path] = ConnectionPool(path)
+    return pool
+
+
+def get_conn(db_path=None):
+    """
+    Returns a pooled connection to the ESG database.
+
+    Use it as `with get_conn() as conn:` so the connection is committed and
+    handed back to the pool when the block ends.
+    Args:
+        db_path (str, optional): Other database file. Defaults to DB_PATH.
+    Returns:
+        PooledConnection: A configured sqlite3 connection.
+    """
+    return get_pool(db_path).get()
+
+
+@contextmanager
+def unit_of_work(db_path=None):
+    """
+    Groups every write in the block into one transaction.
+
+    Helpers that call get_conn() and commit() themselves get the same
+    (per-thread) connection and their commits are deferred, so the block
+    costs one commit instead of one per row. An exception rolls back the
+    whole block. A helper that calls rollback() inside the block discards
+    everything written so far, so the unit then rolls back the rest too and
+    raises UnitRolledBack instead of committing. Nested units join the
+    outermost one.
+
+        with db.unit_of_work() as conn:
+            for row in rows:
+                scope3_spend.add_spend_item(*row)
+            env_water.add_water_record(conn, ...)
+    Args:
+        db_path (str, optional): Other database file. Defaults to DB_PATH.
+    Yields:
+        PooledConnection: The connection the block writes through.
+    Raises:
+        UnitRolledBack: A helper rolled back inside the block.
+    """
+    conn = get_conn(db_path)
+    conn._deferred += 1
+    try:
+        yield conn
+    except BaseException:
+        conn._deferred -= 1
+        if not conn._deferred:
+            conn._rollback_only = False
+            conn.rollback()
+        raise
+    else:
+        conn._deferred -= 1
+        if not conn._deferred:
+            if conn._rollback_only:
+                conn._rollback_only = False
+                conn.rollback()
+                raise UnitRolledBack("rollback() was called inside unit_of_work(); no writes were committed")
+            conn.commit()
+    finally:
+        conn._pool.release(conn)
+
+
+def load_temp_table(conn, name, columns, rows):
+    """
+    (Re)creates a connection-local TEMP table and bulk loads it.
+
+    Used to join lookup data (e.g. emission factors) into a single set-based
+    UPDATE instead of issuing one statement per row.
+    Args:
+        conn: Open connection; the table lives as long as the connection.
+        name (str): Table name (internal constant, not user input).
+        columns (list): Column definitions, e.g. ["ar INTEGER PRIMARY KEY"].
+        rows (iterable): Tuples matching the columns.
+    """
+    conn.execute(f"DROP TABLE IF EXISTS temp.{name}")
+    conn.execute(f"CREATE TEMP TABLE {name} ({', '.join(columns)})")
+    placeholders = ", ".join("?" for _ in columns)
+    conn.executemany(f"INSERT INTO temp.{name} VALUES ({placeholders})", rows)
+
+
+def close_all():
+    """Closes the idle connections of every pool."""
+    with _pools_lock:
+        pools = list(_pools.values())
+    for pool in pools:
+        pool.close_all()
@@ -1,58 +1,310 @@
 import requests
 import time
+import math
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from modules import db
+from modules import postcode_index
 
-def get_distance(postnummer_from, postnummer_to):
+# Persistent cache so the same postal codes/routes are only fetched once.
+# Lives in its own file next to esg_index.db to keep cache writes off the ledger.
+CACHE_DB_PATH = os.path.join(os.path.dirname(db.DB_PATH), "distance_cache.db")
+CACHE_TTL_DAYS = 180
+NOT_FOUND_TTL_DAYS = 7  # Postnummer som Nominatim inte hittar provas igen efter en vecka
+MAX_CACHED_ROUTES = 100000
+
+DETOUR_FACTOR = 1.3  # Omvägsfaktor fågelväg -> bilväg
+DEFAULT_DISTANCE_KM = 15
+
+# Distansbackend: 'osm' (Nominatim + OSRM), 'offline' (postcode_index, inget nätverk)
+# eller 'auto' (offline-index först, OSM för postnummer som saknas i indexet)
+BACKENDS = ('osm', 'offline', 'auto')
+DISTANCE_BACKEND = os.environ.get("ESG_DISTANCE_BACKEND", "osm")
+
+# Nominatims användarpolicy: max 1 anrop/sekund totalt, oavsett antal trådar
+NOMINATIM_MIN_INTERVAL = 1.0
+OSRM_MIN_INTERVAL = 0.2
+MAX_WORKERS = 4
+
+_cache_ready = False
+
+
+class RateLimiter:
+    """Trådsäker gräns för minsta tid mellan anrop (delas av alla trådar)."""
+
+    def __init__(self, min_interval):
+        self.min_interval = min_interval
+        self._next_slot = 0.0
+        self._lock = threading.Lock()
+
+    def wait(self):
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next_slot)
+            self._next_slot = slot + self.min_interval
+        if slot > now:
+            time.sleep(slot - now)
+
+
+NOMINATIM_LIMITER = RateLimiter(NOMINATIM_MIN_INTERVAL)
+OSRM_LIMITER = RateLimiter(OSRM_MIN_INTERVAL)
+
+
+def _normalize(postnummer):
+    return str(postnummer).replace(" ", "").strip()
+
+
+def _cache_conn():
+    global _cache_ready
+    conn = db.get_conn(CACHE_DB_PATH)
+    if not _cache_ready:
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS geo_cache (
+                postnummer TEXT PRIMARY KEY,
+                lat REAL,
+                lon REAL,
+                fetched_at REAL
+            )
+        """)
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS route_cache (
+                from_postnummer TEXT,
+                to_postnummer TEXT,
+                distance_km REAL,
+                fetched_at REAL,
+                PRIMARY KEY (from_postnummer, to_postnummer)
+            )
+        """)
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_route_cache_fetched ON route_cache (fetched_at)")
+        conn.commit()
+        _cache_ready = True
+        prune_cache(conn)
+    return conn
+
+
+def prune_cache(conn=None):
+    """
+    Tar bort utgångna poster och begränsar route_cache till MAX_CACHED_ROUTES
+    (äldsta först). Körs automatiskt en gång per process.
+    """
+    if conn is None:
+        with _cache_conn() as conn:
+            return prune_cache(conn)
+
+    now = time.time()
+    conn.execute("DELETE FROM geo_cache WHERE lat IS NOT NULL AND fetched_at < ?", (now - CACHE_TTL_DAYS * 86400,))
+    conn.execute("DELETE FROM geo_cache WHERE lat IS NULL AND fetched_at < ?", (now - NOT_FOUND_TTL_DAYS * 86400,))
+    conn.execute("DELETE FROM route_cache WHERE fetched_at < ?", (now - CACHE_TTL_DAYS * 86400,))
+    conn.execute("""
+        DELETE FROM route_cache WHERE rowid IN (
+            SELECT rowid FROM route_cache ORDER BY fetched_at DESC LIMIT -1 OFFSET ?
+        )
+    """, (MAX_CACHED_ROUTES,))
+    conn.commit()
+
+
+def _fetch_geocode(postnummer):
+    """
+    Returnerar (svar_ok, koordinater). svar_ok är False vid nätverksfel,
+    då ska resultatet inte cachas.
+    """
+    url = f"https://nominatim.openstreetmap.org/search?postalcode={postnummer}&country=Sweden&format=json"
+    headers = {'User-Agent': 'ESG App/1.0'}
+
+    try:
+        NOMINATIM_LIMITER.wait()  # Rate limiting
+        response = requests.get(url, headers=headers)
+
+        if response.status_code == 200:
+            data = response.json()
+            if data:
+                return True, (float(data[0]['lat']), float(data[0]['lon']))
+            return True, None
+    except Exception:
+        pass
+    return False, None
+
+
+def geocode(postnummer):
+    """
+    Koordinater (lat, lon) för ett postnummer, från cache eller Nominatim.
+    Returns:
+        tuple | None: None om postnumret inte kunde geocodas.
+    """
+    pnr = _normalize(postnummer)
+    now = time.time()
+
+    with _cache_conn() as conn:
+        row = conn.execute("SELECT lat, lon, fetched_at FROM geo_cache WHERE postnummer = ?", (pnr,)).fetchone()
+    if row:
+        lat, lon, fetched_at = row
+        ttl_days = CACHE_TTL_DAYS if lat is not None else NOT_FOUND_TTL_DAYS
+        if now - fetched_at < ttl_days * 86400:
+            return (lat, lon) if lat is not None else None
+
+    ok, coords = _fetch_geocode(pnr)
+    if ok:
+        lat, lon = coords if coords else (None, None)
+        with _cache_conn() as conn:
+            conn.execute("INSERT OR REPLACE INTO geo_cache (postnummer, lat, lon, fetched_at) VALUES (?, ?, ?, ?)",
+                         (pnr, lat, lon, now))
+    return coords
+
+
+def haversine_km(coords_from, coords_to):
+    """Fågelvägsavstånd i km mellan två (lat, lon)."""
+    R = 6371  # Jordens radie i km
+    lat1, lon1 = coords_from
+    lat2, lon2 = coords_to
+
+    dlat = math.radians(lat2 - lat1)
+    dlon = math.radians(lon2 - lon1)
+    a = math.sin(dlat/2)**2 + math.cos(math.radians(lat1)) * math.cos(math.radians(lat2)) * math.sin(dlon/2)**2
+    c = 2 * math.atan2(math.sqrt(a), math.sqrt(1-a))
+    return R * c
+
+
+def _route_key(postnummer_from, postnummer_to):
+    # Bilvägsavståndet antas symmetriskt, så A->B och B->A delar cachepost
+    return tuple(sorted((_normalize(postnummer_from), _normalize(postnummer_to))))
+
+
+def get_cached_route(postnummer_from, postnummer_to):
+    """Cachad bilvägsdistans i km, eller None om den saknas/har gått ut."""
+    key = _route_key(postnummer_from, postnummer_to)
+    with _cache_conn() as conn:
+        row = conn.execute("""
+            SELECT distance_km FROM route_cache
+            WHERE from_postnummer = ? AND to_postnummer = ? AND fetched_at >= ?
+        """, (*key, time.time() - CACHE_TTL_DAYS * 86400)).fetchone()
+    return row[0] if row else None
+
+
+def _store_route(postnummer_from, postnummer_to, distance_km):
+    key = _route_key(postnummer_from, postnummer_to)
+    with _cache_conn() as conn:
+        conn.execute("INSERT OR REPLACE INTO route_cache (from_postnummer, to_postnummer, distance_km, fetched_at) VALUES (?, ?, ?, ?)",
+                     (*key, distance_km, time.time()))
+
+
+def resolve_distances(pairs, backend=None, max_workers=MAX_WORKERS):
     """
-    Hämtar bilvägsavstånd via OpenStreetMap Nominatim + OSRM
+    Löser distanser för en mängd postnummerpar, deduplicerat och parallellt.
+
+    Med backend 'osm' geocodas först alla unika postnummer och sedan hämtas
+    alla unika rutter, båda stegen i en trådpool. Nätverksanropen går genom
+    de globala rate limiters, så Nominatims policy hålls oavsett max_workers.
+    Args:
+        pairs (iterable): (postnummer_from, postnummer_to)-tupler.
+        backend (str, optional): Se BACKENDS. Defaults to DISTANCE_BACKEND.
+        max_workers (int): Antal trådar för nätverksanrop.
+    Returns:
+        dict: {(postnummer_from, postnummer_to): km} för varje unikt par. Med
+            backend 'offline' är distansen NaN för postnummer som saknas i indexet.
+    Raises:
+        FileNotFoundError: Backend 'offline' och postnummerindexet är inte byggt.
     """
-    
+    backend = backend or DISTANCE_BACKEND
+    if backend not in BACKENDS:
+        raise ValueError(f"Okänd distansbackend: {backend}")
+
+    unique = list(dict.fromkeys(pairs))
+    result = {}
+    pending = unique
+
+    if backend != 'osm':
+        # Offline utan byggt index vore bara gissningar; 'auto' faller tillbaka på OSM
+        index = postcode_index.require_index() if backend == 'offline' else None
+        km = postcode_index.distances_km([a for a, _ in unique], [b for _, b in unique], DETOUR_FACTOR, index)
+        pending = []
+        for pair, d in zip(unique, km):
+            if not math.isnan(d):
+                result[pair] = float(d)
+            elif backend == 'auto':
+                pending.append(pair)
+            else:
+                result[pair] = math.nan # Postnumret saknas i indexet; anroparen flaggar raden
+
+    # Cachade rutter kräver inget nätverk
+    to_fetch = []
+    for pair in pending:
+        cached = get_cached_route(*pair)
+        if cached is not None:
+            result[pair] = cached
+        else:
+            to_fetch.append(pair)
+
+    if to_fetch:
+        postnummer = list(dict.fromkeys(p for pair in to_fetch for p in pair))
+        with ThreadPoolExecutor(max_workers=max_workers) as pool:
+            # Steg 1: varje postnummer geocodas en gång (resultatet hamnar i geo_cache)
+            list(pool.map(geocode, postnummer))
+            # Steg 2: rutterna, geocodningen läses nu från cachen
+            for pair, d in zip(to_fetch, pool.map(lambda p: _get_osm_distance(*p), to_fetch)):
+                result[pair] = d
+
+    return result
+
+
+def get_distances(postnummer_from, postnummer_to, backend=None):
+    """
+    Distanser i km för många par av postnummer.
+    Paren dedupliceras och löses via resolve_distances(); med backend
+    'offline'/'auto' beräknas de i ett NumPy-svep mot postcode_index.
+    Args:
+        postnummer_from (list): Startpostnummer.
+        postnummer_to (list): Målpostnummer, samma längd.
+        backend (str, optional): Se BACKENDS. Defaults to DISTANCE_BACKEND.
+    Returns:
+        list: Distans i km per par (NaN där den inte kunde bestämmas offline).
+    """
+    pairs = list(zip(postnummer_from, postnummer_to))
+    resolved = resolve_distances(pairs, backend)
+    return [resolved[pair] for pair in pairs]
+
+
+def get_distance(postnummer_from, postnummer_to, backend=None):
+    """
+    Hämtar bilvägsavstånd för ett par postnummer med vald backend.
+    """
+    return get_distances([postnummer_from], [postnummer_to], backend)[0]
+
+
+def _get_osm_distance(postnummer_from, postnummer_to):
+    """
+    Hämtar bilvägsavstånd via OpenStreetMap Nominatim + OSRM.
+    Cachen (geo_cache/route_cache) konsulteras före varje nätverksanrop.
+    """
+    cached = get_cached_route(postnummer_from, postnummer_to)
+    if cached is not None:
+        return cached
+
     # Steg 1: Geocoda postnummer
-    def geocode(postnummer):
-        url = f"https://nominatim.openstreetmap.org/search?postalcode={postnummer}&country=Sweden&format=json"
-        headers = {'User-Agent': 'ESG App/1.0'}
-        
-        try:
-            response = requests.get(url, headers=headers)
-            time.sleep(1)  # Rate limiting
-            
-            if response.status_code == 200:
-                data = response.json()
-                if data:
-                    return float(data[0]['lat']), float(data[0]['lon'])
-        except:
-            pass
-        return None
-    
     coords_from = geocode(postnummer_from)
     coords_to = geocode(postnummer_to)
-    
+
     if not coords_from or not coords_to:
         # Fallback: Fågelväg × 1.3
-        import math
-        R = 6371  # Jordens radie i km
-        
-        lat1, lon1 = coords_from if coords_from else (58.4, 15.6)  # Linköping default
-        lat2, lon2 = coords_to if coords_to else (58.6, 16.2)
-        
-        dlat = math.radians(lat2 - lat1)
-        dlon = math.radians(lon2 - lon1)
-        a = math.sin(dlat/2)**2 + math.cos(math.radians(lat1)) * math.cos(math.radians(lat2)) * math.sin(dlon/2)**2
-        c = 2 * math.atan2(math.sqrt(a), math.sqrt(1-a))
-        
-        return R * c * 1.3  # Omvägsfaktor
-    
+        return haversine_km(
+            coords_from if coords_from else (58.4, 15.6),  # Linköping default
+            coords_to if coords_to else (58.6, 16.2)
+        ) * DETOUR_FACTOR
+
     # Steg 2: Hämta bilvägsavstånd via OSRM
     url = f"http://router.project-osrm.org/route/v1/driving/{coords_from[1]},{coords_from[0]};{coords_to[1]},{coords_to[0]}?overview=false"
-    
+
     try:
+        OSRM_LIMITER.wait()
         response = requests.get(url)
-        
+
         if response.status_code == 200:
             data = response.json()
             if data['routes']:
-                distance_m = data['routes'][0]['distance']
-                return distance_m / 1000  # Returnera km
-    except:
+                distance_km = data['routes'][0]['distance'] / 1000  # Returnera km
+                _store_route(postnummer_from, postnummer_to, distance_km)
+                return distance_km
+    except Exception:
         pass
-    
-    return 15  # Default fallback
\ No newline at end of file
+
+    return DEFAULT_DISTANCE_KM  # Default fallback
@@ -1,13 +1,7 @@
 import pandas as pd
-import streamlit as st
-import sqlite3
-import os
 from datetime import datetime
-
-def get_conn():
-    path = "database/esg_index.db"
-    if not os.path.exists(path) and os.path.exists(f"../{path}"): path = f"../{path}"
-    return sqlite3.connect(path)
+from modules.db import get_conn
+from modules.query_cache import cached_query, invalidate
 
 ESRS_MAP = {
     "Klimat": "E1", "Energi": "E1", "Föroreningar": "E2", "Vatten": "E3", "Biodiversitet": "E4", "Cirkulär ekonomi": "E5",
@@ -15,7 +9,7 @@ ESRS_MAP = {
     "Berörda samhällen": "S3", "Konsumenter": "S4", "Affärsetik": "G1", "Governance": "G1"
 }
 
-@st.cache_data(ttl=60)
+@cached_query(['f_DMA_Materiality'])
 def get_dma_data():
     try:
         with get_conn() as conn:
@@ -37,26 +31,41 @@ def add_dma_topic(topic, impact, financial, category):
             VALUES (?, ?, ?, ?, ?, ?, ?, ?)
         """, (topic, impact, financial, esrs_code, category, is_material, datetime.now().strftime('%Y-%m-%d'), datetime.now().strftime('%Y-%m-%d')))
         conn.commit()
-    st.cache_data.clear()
+    invalidate('f_DMA_Materiality')
 
 def delete_dma_topic(topic_id):
     with get_conn() as conn:
         conn.execute("DELETE FROM f_DMA_Materiality WHERE id = ?", (topic_id,))
         conn.commit()
-    st.cache_data.clear()
+    invalidate('f_DMA_Materiality')
 
 # --- IRO FUNCTIONS ---
 
+IRO_INSERT = """
+    INSERT INTO f_DMA_IRO (dma_topic_id, type, description, time_horizon, financial_effect)
+    VALUES (?, ?, ?, ?, ?)
+"""
+
 def add_iro(topic_id, iro_type, description, time_horizon, financial_effect):
     """
     Adds an Impact, Risk, or Opportunity (IRO) to a material topic.
     """
     with get_conn() as conn:
-        conn.execute("""
-            INSERT INTO f_DMA_IRO (dma_topic_id, type, description, time_horizon, financial_effect)
-            VALUES (?, ?, ?, ?, ?)
-        """, (topic_id, iro_type, description, time_horizon, financial_effect))
+        conn.execute(IRO_INSERT, (topic_id, iro_type, description, time_horizon, financial_effect))
+        conn.commit()
+
+def add_iros(records):
+    """
+    Adds many IROs in one transaction.
+    Args:
+        records (iterable): Dicts with add_iro()'s argument names or tuples in the same order.
+    """
+    fields = ("topic_id", "iro_type", "description", "time_horizon", "financial_effect")
+    rows = [tuple(r[f] for f in fields) if isinstance(r, dict) else tuple(r) for r in records]
+    with get_conn() as conn:
+        conn.executemany(IRO_INSERT, rows)
         conn.commit()
+    return len(rows)
 
 def get_iros(topic_id):
     """
@@ -0,0 +1,153 @@
+"""
+Materialized emissions rollup (f_Emissions_Summary).
+
+One row per reporting period, scope and category, kept up to date by
+triggers on the source tables. The overview reads its totals from here with
+a single indexed query instead of summing every fact table on each rerun.
+"""
+import pandas as pd
+
+from modules import analytics
+from modules import migrations
+
+# (kategori, scope, källtabell, periodkolumn-uttryck, värde i ton)
+SOURCES = [
+    ('Drivmedel', 1, 'f_Drivmedel', "strftime('%Y', {row}.datum)", "{row}.co2_kg / 1000.0"),
+    ('Energi', 2, 'f_Energi', "CAST({row}.ar AS TEXT)", "{row}.scope2_market_based_kg / 1000.0"),
+    ('Spend-baserat', 3, 'f_Scope3_Calculations', "{row}.reporting_period", "{row}.co2e_tonnes"),
+    ('Affärsresor', 3, 'f_Scope3_BusinessTravel', "strftime('%Y', {row}.date)", "{row}.co2_kg / 1000.0"),
+    ('Avfall', 3, 'f_Scope3_Waste', "strftime('%Y', {row}.date)", "{row}.co2_kg / 1000.0"),
+    ('Inköpta varor & tjänster', 3, 'f_Scope3_PurchasedGoodsServices', "strftime('%Y', {row}.date)", "{row}.co2_kg / 1000.0"),
+]
+
+# Scope 3 räknas från spend-tabellen; övriga Scope 3-källor används bara när den är tom
+SCOPE3_PRIMARY = 'Spend-baserat'
+
+
+def _upsert(category, scope, period, value, sign):
+    return f"""
+        INSERT INTO f_Emissions_Summary (period, scope, category, co2_ton, row_count)
+        VALUES (COALESCE({period}, ''), {scope}, '{category}', {sign}COALESCE({value}, 0), {sign}1)
+        ON CONFLICT(period, scope, category) DO UPDATE SET
+            co2_ton = co2_ton + excluded.co2_ton,
+            row_count = row_count + excluded.row_count;
+    """
+
+
+def ensure_summary(conn):
+    """
+    Skapar tabellen och triggers (idempotent). Första gången byggs
+    tabellen upp från befintlig data. Hoppas över om schemat är aktuellt.
+    """
+    if migrations.is_current(conn):
+        return
+    exists = conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'f_Emissions_Summary'").fetchone()
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS f_Emissions_Summary (
+            period TEXT NOT NULL,
+            scope INTEGER NOT NULL,
+            category TEXT NOT NULL,
+            co2_ton REAL DEFAULT 0,
+            row_count INTEGER DEFAULT 0,
+            PRIMARY KEY (period, scope, category)
+        )
+    """)
+
+    for category, scope, table, period, value in SOURCES:
+        new_period, new_value = period.format(row="NEW"), value.format(row="NEW")
+        old_period, old_value = period.format(row="OLD"), value.format(row="OLD")
+        conn.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS trg_{table}_sum_ins AFTER INSERT ON {table}
+            BEGIN {_upsert(category, scope, new_period, new_value, '')} END
+        """)
+        conn.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS trg_{table}_sum_upd AFTER UPDATE ON {table}
+            BEGIN
+                {_upsert(category, scope, old_period, old_value, '-')}
+                {_upsert(category, scope, new_period, new_value, '')}
+            END
+        """)
+        conn.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS trg_{table}_sum_del AFTER DELETE ON {table}
+            BEGIN {_upsert(category, scope, old_period, old_value, '-')} END
+        """)
+
+    if not exists:
+        rebuild_summary(conn)
+    conn.commit()
+
+
+def rebuild_summary(conn):
+    """Bygger om hela sammanställningen från källtabellerna (t.ex. efter bulkimport med triggers avstängda)."""
+    conn.execute("DELETE FROM f_Emissions_Summary")
+    for category, scope, table, period, value in SOURCES:
+        conn.execute(f"""
+            INSERT INTO f_Emissions_Summary (period, scope, category, co2_ton, row_count)
+            SELECT COALESCE({period.format(row=table)}, ''), ?, ?, COALESCE(SUM({value.format(row=table)}), 0), COUNT(*)
+            FROM {table}
+            GROUP BY 1
+        """, (scope, category))
+    conn.commit()
+
+
+def get_summary(conn, period=None):
+    """
+    Sammanställningen som DataFrame (period, scope, category, co2_ton, row_count).
+    """
+    if period is None:
+        return pd.read_sql("SELECT * FROM f_Emissions_Summary ORDER BY period, scope, category", conn)
+    return pd.read_sql("SELECT * FROM f_Emissions_Summary WHERE period = ? ORDER BY scope, category",
+                       conn, params=(str(period),))
+
+
+def select_scope3(scope3_by_category):
+    """
+    Scope 3-definitionen som översikt, PDF och Excel delar: spend-tabellen om
+    den har värden, annars summan av övriga Scope 3-kategorier.
+    Args:
+        scope3_by_category (dict): {kategori: värde} ur f_Emissions_Summary.
+    Returns:
+        tuple: (Scope 3-total, {kategori: värde} för de kategorier som räknats).
+    """
+    primary = scope3_by_category.get(SCOPE3_PRIMARY, 0.0)
+    if abs(primary) >= 1e-9:
+        return primary, {SCOPE3_PRIMARY: primary}
+    # Tom (eller nollad via delta-uppdateringar)
+    return sum(scope3_by_category.values(), 0.0), dict(scope3_by_category)
+
+
+def get_scope_breakdown(conn, period=None):
+    """
+    Totaler i ton per scope samt de Scope 3-kategorier som ingår i totalen.
+    Aggregatet körs i DuckDB om analysmotorn är igång, annars i SQLite.
+    Args:
+        period (str|int, optional): Rapportår. Defaults to alla år.
+    Returns:
+        tuple: ((scope1, scope2, scope3) i ton, {Scope 3-kategori: ton}).
+    """
+    if period is None:
+        rows = analytics.read_df("scope_category_totals", conn=conn)
+    else:
+        rows = analytics.read_df("scope_category_totals_period", {"period": str(period)}, conn)
+
+    totals = {1: 0.0, 2: 0.0}
+    scope3 = {}
+    for scope, category, ton in rows.fillna({'co2_ton': 0.0}).itertuples(index=False):
+        if scope == 3:
+            scope3[category] = ton
+        else:
+            totals[int(scope)] = totals.get(int(scope), 0.0) + ton
+
+    s3, counted = select_scope3(scope3)
+    return (totals[1], totals[2], s3), counted
+
+
+def get_scope_totals(conn, period=None):
+    """
+    Totaler i ton per scope, samma logik som översiktens tidigare SUM-frågor.
+    Args:
+        period (str|int, optional): Rapportår. Defaults to alla år.
+    Returns:
+        tuple: (scope1, scope2, scope3) i ton.
+    """
+    return get_scope_breakdown(conn, period)[0]
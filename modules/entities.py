@@ -0,0 +1,295 @@
+"""
+Multi-entity (group) reporting.
+
+d_Entity in the group database lists the subsidiaries. The group database
+itself holds the parent company's own ledger. Each subsidiary has its own
+database file under database/entities/. The file has the same schema,
+triggers and reference data as the group database, so every module works
+on it unchanged through db.get_conn(path). Entity files are opened on
+demand. A file is brought up to the group's schema version (missing
+tables, columns, indexes and triggers are added) before it is used.
+
+consolidate() rolls the scope totals up across entities. Each entity is
+rolled up in a separate worker process, so group reporting scales with
+the number of subsidiaries rather than running one ledger after another.
+"""
+import os
+import re
+
+import pandas as pd
+
+from modules import db
+from modules import emissions_summary
+from modules import migrations
+from modules.worker_pool import WorkerPool
+
+PARENT_ENTITY = "parent"
+
+# Metod -> visningsnamn (GHG-protokollets konsolideringsansatser)
+CONSOLIDATION_METHODS = {
+    "operational_control": "Operativ kontroll",
+    "financial_control": "Finansiell kontroll",
+    "equity_share": "Ägarandel",
+}
+
+# Tabeller som bara finns i koncerndatabasen
+GROUP_ONLY_TABLES = {"d_Entity", "system_report_jobs"}
+
+# Referensdata som kopieras till nya bolagsfiler (fakta kopieras aldrig)
+REFERENCE_TABLES = ["f_ESRS_Requirements", "system_config", "system_schema_migrations"]
+
+MAX_WORKERS = min(4, os.cpu_count() or 1)
+
+_ENTITY_ID = re.compile(r"^[a-z0-9][a-z0-9_-]{0,63}$")
+_OBJECT_ORDER = {"table": 0, "view": 1, "index": 2, "trigger": 3}
+
+_workers = WorkerPool(MAX_WORKERS)
+
+
+def entities_dir():
+    """Katalog för dotterbolagens databasfiler, bredvid koncerndatabasen."""
+    return os.path.join(os.path.dirname(db.DB_PATH), "entities")
+
+
+def entity_db_path(entity_id, db_file=None):
+    """Sökvägen till ett bolags databasfil (moderbolaget: koncerndatabasen)."""
+    if entity_id == PARENT_ENTITY:
+        return db.DB_PATH
+    return os.path.join(entities_dir(), db_file or f"{entity_id}.db")
+
+
+def _add_missing_columns(conn, table):
+    existing = {row[1] for row in conn.execute(f"PRAGMA main.table_info({table})")}
+    for _, name, declared, notnull, default, pk in conn.execute(f"PRAGMA grp.table_info({table})").fetchall():
+        if name in existing or pk or (notnull and default is None):
+            continue
+        column = f"{name} {declared}" + (f" DEFAULT {default}" if default is not None else "")
+        conn.execute(f"ALTER TABLE main.{table} ADD COLUMN {column}")
+
+
+def _copy_reference_rows(conn, table):
+    if conn.execute(f"SELECT 1 FROM main.{table} LIMIT 1").fetchone():
+        return
+    main_columns = {row[1] for row in conn.execute(f"PRAGMA main.table_info({table})")}
+    columns = ", ".join(row[1] for row in conn.execute(f"PRAGMA grp.table_info({table})") if row[1] in main_columns)
+    conn.execute(f"INSERT OR IGNORE INTO main.{table} ({columns}) SELECT {columns} FROM grp.{table}")
+
+
+def sync_schema(conn, group_path=None):
+    """
+    Tar en bolagsfil till koncerndatabasens schemaversion: saknade tabeller,
+    kolumner, index, vyer och triggers läggs till och referensdata kopieras
+    till tomma referenstabeller. Befintlig data ändras aldrig.
+    Args:
+        conn: Anslutning till bolagsfilen (ingen öppen transaktion).
+        group_path (str, optional): Koncerndatabasen. Defaults to DB_PATH.
+    Returns:
+        bool: True om filen uppdaterades.
+    """
+    conn.execute("ATTACH DATABASE ? AS grp", (group_path or db.DB_PATH,))
+    try:
+        group_version = conn.execute("PRAGMA grp.user_version").fetchone()[0]
+        if migrations.current_version(conn) >= group_version:
+            return False
+
+        objects = conn.execute("""
+            SELECT type, name, tbl_name, sql FROM grp.sqlite_master
+            WHERE sql IS NOT NULL AND name NOT LIKE 'sqlite_%'
+        """).fetchall()
+        existing = {row[0] for row in conn.execute("SELECT name FROM main.sqlite_master")}
+
+        conn.execute("BEGIN")
+        try:
+            # Tabeller först, sedan vyer, index och triggers som refererar till dem
+            for kind, name, table, sql in sorted(objects, key=lambda o: _OBJECT_ORDER.get(o[0], 9)):
+                if table in GROUP_ONLY_TABLES:
+                    continue
+                if name not in existing:
+                    conn.execute(sql)
+                elif kind == "table":
+                    _add_missing_columns(conn, name)
+            group_tables = {name for kind, name, _, _ in objects if kind == "table"}
+            for table in REFERENCE_TABLES:
+                if table in group_tables:
+                    _copy_reference_rows(conn, table)
+            conn.execute(f"PRAGMA user_version = {int(group_version)}")
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        return True
+    finally:
+        conn.execute("DETACH DATABASE grp")
+
+
+def resolve(entity_id):
+    """
+    Sökvägen till ett bolags databasfil, med schemat uppdaterat vid behov.
+    För funktioner som tar db_path, t.ex. bulk_import.import_file().
+    Raises:
+        ValueError: Okänt bolag.
+    """
+    path = entity_db_path(entity_id, _db_file(entity_id))
+    if entity_id != PARENT_ENTITY:
+        with db.get_conn(path) as conn:
+            if not migrations.is_current(conn):
+                sync_schema(conn)
+    return path
+
+
+def get_conn(entity_id):
+    """
+    Poolad anslutning till ett bolags databas, schemat uppdaterat vid behov.
+    Använd som `with entities.get_conn('dotterbolag') as conn:`.
+    """
+    return db.get_conn(resolve(entity_id))
+
+
+def _db_file(entity_id):
+    if entity_id == PARENT_ENTITY:
+        return None
+    with db.get_conn() as conn:
+        row = conn.execute("SELECT db_file FROM d_Entity WHERE entity_id = ?", (entity_id,)).fetchone()
+    if row is None:
+        raise ValueError(f"Okänt bolag: {entity_id}")
+    return row[0]
+
+
+def list_entities(include_inactive=False):
+    """
+    Koncernens bolag, moderbolaget först.
+    Returns:
+        pd.DataFrame: entity_id, name, org_nr, parent_id, ownership_pct,
+            consolidation_method, db_file, is_active.
+    """
+    sql = """
+        SELECT entity_id, name, org_nr, parent_id, ownership_pct, consolidation_method, db_file, is_active
+        FROM d_Entity
+    """
+    if not include_inactive:
+        sql += " WHERE is_active = 1"
+    with db.get_conn() as conn:
+        return pd.read_sql(sql + " ORDER BY entity_id != ?, name", conn, params=(PARENT_ENTITY,))
+
+
+def add_entity(entity_id, name, org_nr=None, ownership_pct=100.0,
+               consolidation_method="operational_control", parent_id=PARENT_ENTITY):
+    """
+    Registrerar ett dotterbolag och skapar dess databasfil.
+    Args:
+        entity_id (str): Kort id (a-z, 0-9, '-', '_'); blir filnamnet.
+        name (str): Bolagets namn.
+        org_nr (str, optional): Organisationsnummer.
+        ownership_pct (float): Koncernens ägarandel i procent (0-100).
+        consolidation_method (str): Nyckel i CONSOLIDATION_METHODS.
+        parent_id (str): Ägande bolag. Defaults to moderbolaget.
+    Returns:
+        str: Sökvägen till bolagets databasfil.
+    Raises:
+        ValueError: Ogiltigt id, metod eller ägarandel, eller id som redan finns.
+        RuntimeError: Koncerndatabasen har inte aktuellt schema (kör init_db först).
+    """
+    if not _ENTITY_ID.match(entity_id or "") or entity_id == PARENT_ENTITY:
+        raise ValueError(f"Ogiltigt bolags-id: {entity_id!r} (a-z, 0-9, '-' och '_')")
+    if consolidation_method not in CONSOLIDATION_METHODS:
+        raise ValueError(f"Okänd konsolideringsmetod: {consolidation_method}")
+    if not 0 <= float(ownership_pct) <= 100:
+        raise ValueError("Ägarandelen måste vara mellan 0 och 100 %")
+
+    with db.get_conn() as conn:
+        if not migrations.is_current(conn):
+            raise RuntimeError("Koncerndatabasen har inte aktuellt schema; kör init_db först.")
+        if conn.execute("SELECT 1 FROM d_Entity WHERE entity_id = ?", (entity_id,)).fetchone():
+            raise ValueError(f"Bolaget {entity_id} finns redan")
+
+        db_file = f"{entity_id}.db"
+        path = entity_db_path(entity_id, db_file)
+        os.makedirs(entities_dir(), exist_ok=True)
+        with db.get_conn(path) as entity_conn:
+            sync_schema(entity_conn)
+            entity_conn.execute("UPDATE system_config SET value = ? WHERE key = 'company_name'", (name,))
+            entity_conn.commit()
+
+        conn.execute(
+            """INSERT INTO d_Entity (entity_id, name, org_nr, parent_id, ownership_pct, consolidation_method, db_file)
+               VALUES (?, ?, ?, ?, ?, ?, ?)""",
+            (entity_id, name, org_nr, parent_id, float(ownership_pct), consolidation_method, db_file),
+        )
+        conn.commit()
+    return path
+
+
+def set_entity_active(entity_id, active):
+    """Tar med eller utesluter ett bolag ur konsolideringen (filen behålls)."""
+    with db.get_conn() as conn:
+        conn.execute("UPDATE d_Entity SET is_active = ? WHERE entity_id = ?", (1 if active else 0, entity_id))
+        conn.commit()
+
+
+# --- Konsolidering (körs i arbetsprocesser) ---
+
+def _entity_totals(db_path, group_path, period):
+    """(scope1, scope2, scope3) i ton för en bolagsfil; omräkning sker vid import, inte här."""
+    with db.get_conn(db_path) as conn:
+        if db_path != group_path and not migrations.is_current(conn):
+            sync_schema(conn, group_path)
+        return emissions_summary.get_scope_totals(conn, period)
+
+
+def _share(method, ownership_pct):
+    # Kontrollansatserna tar med 100 % av kontrollerade bolag, ägarandelsansatsen sin andel
+    return (ownership_pct or 0) / 100.0 if method == "equity_share" else 1.0
+
+
+def consolidate(period=None, parallel=True):
+    """
+    Konsoliderar scope 1-3 över koncernens aktiva bolag.
+    Args:
+        period (str|int, optional): Rapportår. Defaults to alla år.
+        parallel (bool): Ett bolag per arbetsprocess (annars i den här processen).
+    Returns:
+        pd.DataFrame: Ett bolag per rad med entity_id, name, consolidation_method,
+            share, scope1, scope2, scope3 (brutto, ton), total (konsoliderat,
+            ton) och error (om bolaget inte kunde läsas).
+    """
+    entity_rows = list_entities()
+    jobs = [
+        (row.entity_id, entity_db_path(row.entity_id, row.db_file))
+        for row in entity_rows.itertuples(index=False)
+    ]
+
+    results = {}
+    group_path = db.DB_PATH
+    if parallel and len(jobs) > 1:
+        futures = {entity_id: _workers.submit(_entity_totals, path, group_path, period) for entity_id, path in jobs}
+        for entity_id, future in futures.items():
+            try:
+                results[entity_id] = (future.result(), None)
+            except Exception as e:
+                results[entity_id] = ((None, None, None), str(e))
+    else:
+        for entity_id, path in jobs:
+            try:
+                results[entity_id] = (_entity_totals(path, group_path, period), None)
+            except Exception as e:
+                results[entity_id] = ((None, None, None), str(e))
+
+    rows = []
+    for row in entity_rows.itertuples(index=False):
+        (s1, s2, s3), error = results[row.entity_id]
+        share = _share(row.consolidation_method, row.ownership_pct)
+        total = None if error else (s1 + s2 + s3) * share
+        rows.append((row.entity_id, row.name, row.consolidation_method, share, s1, s2, s3, total, error))
+    return pd.DataFrame(rows, columns=[
+        "entity_id", "name", "consolidation_method", "share", "scope1", "scope2", "scope3", "total", "error",
+    ])
+
+
+def group_totals(consolidated):
+    """
+    Koncernens totaler ur consolidate(): varje bolags scope viktat med dess andel.
+    Returns:
+        tuple: (scope1, scope2, scope3) i ton.
+    """
+    ok = consolidated[consolidated["error"].isna()]
+    return tuple(float((ok[scope] * ok["share"]).sum()) for scope in ("scope1", "scope2", "scope3"))
@@ -1,14 +1,31 @@
 import pandas as pd
 import sqlite3
 
+WASTE_INSERT = """
+    INSERT INTO f_Waste_Detailed 
+    (date, waste_category, is_hazardous, weight_kg, treatment_method, supplier)
+    VALUES (?, ?, ?, ?, ?, ?)
+"""
+
+def _waste_row(date, category, is_hazardous, weight, method, supplier):
+    return (date, category, 1 if is_hazardous else 0, weight, method, supplier)
+
 def add_detailed_waste_record(conn, date, category, is_hazardous, weight, method, supplier):
     """Adds a new detailed waste record."""
-    conn.execute("""
-        INSERT INTO f_Waste_Detailed 
-        (date, waste_category, is_hazardous, weight_kg, treatment_method, supplier)
-        VALUES (?, ?, ?, ?, ?, ?)
-    """, (date, category, 1 if is_hazardous else 0, weight, method, supplier))
+    conn.execute(WASTE_INSERT, _waste_row(date, category, is_hazardous, weight, method, supplier))
+    conn.commit()
+
+def add_detailed_waste_records(conn, records):
+    """
+    Adds many detailed waste records in one transaction.
+    Args:
+        records (iterable): Dicts with add_detailed_waste_record()'s argument
+            names (without conn) or tuples in the same order.
+    """
+    rows = [_waste_row(**r) if isinstance(r, dict) else _waste_row(*r) for r in records]
+    conn.executemany(WASTE_INSERT, rows)
     conn.commit()
+    return len(rows)
 
 def get_detailed_waste_data(conn):
     """Fetches all detailed waste records."""
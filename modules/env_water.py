@@ -1,20 +1,56 @@
 import pandas as pd
 import sqlite3
+from modules import analytics
+
+WATER_INSERT = """
+    INSERT INTO f_Water_Data 
+    (date, withdrawal_m3, withdrawal_source, discharge_m3, discharge_dest, consumption_m3, recycled_m3)
+    VALUES (?, ?, ?, ?, ?, ?, ?)
+"""
+
+def _water_row(date, withdrawal, source, discharge, dest, recycled):
+    consumption = withdrawal - discharge
+    return (date, withdrawal, source, discharge, dest, consumption, recycled)
 
 def add_water_record(conn, date, withdrawal, source, discharge, dest, recycled):
     """Adds a new water record to the database."""
-    consumption = withdrawal - discharge
-    conn.execute("""
-        INSERT INTO f_Water_Data 
-        (date, withdrawal_m3, withdrawal_source, discharge_m3, discharge_dest, consumption_m3, recycled_m3)
-        VALUES (?, ?, ?, ?, ?, ?, ?)
-    """, (date, withdrawal, source, discharge, dest, consumption, recycled))
+    conn.execute(WATER_INSERT, _water_row(date, withdrawal, source, discharge, dest, recycled))
     conn.commit()
 
+def add_water_records(conn, records):
+    """
+    Adds many water records in one transaction.
+    Args:
+        records (iterable): Dicts with add_water_record()'s argument names
+            (without conn) or tuples in the same order.
+    """
+    rows = [_water_row(**r) if isinstance(r, dict) else _water_row(*r) for r in records]
+    conn.executemany(WATER_INSERT, rows)
+    conn.commit()
+    return len(rows)
+
 def get_water_data(conn):
     """Fetches all water data records."""
     return pd.read_sql("SELECT * FROM f_Water_Data ORDER BY date DESC", conn)
 
+def get_water_metrics(conn=None):
+    """
+    Summary metrics for water usage, aggregated in the database (DuckDB when
+    the analytics engine is available) instead of over a loaded DataFrame.
+    """
+    totals = analytics.read_df("water_totals", conn=conn).iloc[0]
+    if not totals["records"]:
+        return {"total_withdrawal": 0, "total_consumption": 0, "recycling_rate": 0}
+
+    total_withdrawal = float(totals["total_withdrawal"])
+    recycling_rate = (float(totals["total_recycled"]) / total_withdrawal * 100) if total_withdrawal > 0 else 0
+
+    return {
+        "total_withdrawal": total_withdrawal,
+        "total_consumption": float(totals["total_consumption"]),
+        "recycling_rate": recycling_rate
+    }
+
 def calculate_water_metrics(df):
     """Calculates summary metrics for water usage."""
     if df.empty:
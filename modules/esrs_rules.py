@@ -0,0 +1,218 @@
+"""
+Declarative ESRS evidence rules.
+
+Each disclosure requirement maps to the tables that count as evidence, the
+filter that ties a row to a reporting year and the thresholds for partial and
+complete coverage. The rules are compiled once per database schema into a
+single prepared SELECT (one scalar subquery per evidence source), so
+evaluating every requirement for a year costs one round trip regardless of
+how many codes are registered.
+"""
+from modules.db import get_conn
+from modules import queries
+
+REPORTED = "✅ Rapporterad"
+PARTIAL = "⚠️ Delvis"
+MISSING = "❌ Saknas"
+
+# Återkommande årsfilter (:year = '2025', :year_int = 2025)
+YEAR_BY_DATE = "strftime('%Y', {col}) = :year"
+
+# Regeltyper:
+#   count  - antal rader i källorna. mode 'any': summan jämförs mot trösklarna,
+#            mode 'all': komplett när alla källor har data, delvis när några har.
+#   value  - ett enskilt värde (t.ex. nyckeltal) som ska finnas för året.
+#   policy - antal policys vars esrs_requirement börjar med prefixet.
+# Nycklar som slutar med '*' gäller alla koder i familjen (t.ex. 'G1*').
+RULES = {
+    "E1-5": {
+        "kind": "count", "mode": "any", "complete": 1,
+        "sources": [("f_Energi", "ar = :year_int")],
+        "comment": "Energidata finns ({n} poster).",
+    },
+    "E1-6": {
+        "kind": "count", "mode": "any", "complete": 1,
+        "sources": [
+            ("f_Drivmedel", YEAR_BY_DATE.format(col="datum")),
+            ("f_Energi", "ar = :year_int"),
+            ("f_Scope3_Calculations", "reporting_period = :year"),
+        ],
+        "comment": "Data finns ({n} poster).",
+    },
+    "E3-4": {
+        "kind": "count", "mode": "any", "complete": 1,
+        "sources": [("f_Water_Data", YEAR_BY_DATE.format(col="date"))],
+        "comment": "Vattendata finns ({n} poster).",
+    },
+    "E5-5": {
+        "kind": "count", "mode": "any", "complete": 1,
+        "sources": [("f_Waste_Detailed", YEAR_BY_DATE.format(col="date"))],
+        "comment": "Avfallsdata finns ({n} poster).",
+    },
+    "S1-16": {
+        "kind": "value",
+        "source": ("f_HR_Arsdata", "gender_pay_gap_pct", "ar = :year_int"),
+        "comment": "Lönegap: {value}%.",
+    },
+    "G1*": {
+        "kind": "policy", "prefix": "G1", "complete": 1,
+        "comment": "{n} dokument.",
+    },
+}
+
+# Manuell bedömning i GAP-analysen används för koder utan (tillräckligt) dataunderlag
+GAP_STATUS = {
+    "Compliant": (REPORTED, "Bedömd i GAP-analysen."),
+    "Completed": (REPORTED, "Bedömd i GAP-analysen."),
+    "In Progress": (PARTIAL, "Pågår enligt GAP-analysen."),
+}
+
+
+def evidence_tables():
+    """Alla tabeller som reglerna läser (för cache-taggning)."""
+    tables = {"f_ESRS_Requirements", "f_GAP_Analysis"}
+    for rule in RULES.values():
+        if rule["kind"] == "count":
+            tables.update(table for table, _ in rule["sources"])
+        elif rule["kind"] == "value":
+            tables.add(rule["source"][0])
+        elif rule["kind"] == "policy":
+            tables.add("f_Governance_Policies")
+    return sorted(tables)
+
+
+def _subqueries():
+    """(alias, SQL, statiska parametrar) för varje evidenskälla i registret."""
+    for key, rule in RULES.items():
+        slug = key.replace("-", "_").replace("*", "_all")
+        if rule["kind"] == "count":
+            for i, (table, condition) in enumerate(rule["sources"]):
+                yield f"{slug}__{i}", f"SELECT COUNT(*) FROM {table} WHERE {condition}", {}
+        elif rule["kind"] == "value":
+            table, column, condition = rule["source"]
+            yield f"{slug}__0", f"SELECT {column} FROM {table} WHERE {condition} LIMIT 1", {}
+        elif rule["kind"] == "policy":
+            param = f"prefix_{slug}"
+            yield (f"{slug}__0",
+                   f"SELECT COUNT(*) FROM f_Governance_Policies WHERE esrs_requirement LIKE :{param} || '%'",
+                   {param: rule["prefix"]})
+
+
+class CompiledRules:
+    """Registret kompilerat mot ett databasschema: en SELECT för alla källor."""
+
+    def __init__(self, conn):
+        self.params = {}
+        self.aliases = []
+        columns = []
+        probe = {"year": "0", "year_int": 0}
+        for alias, sql, params in _subqueries():
+            # Källor vars tabell/kolumn saknas i schemat hoppas över (räknas som saknad data)
+            try:
+                conn.execute(f"EXPLAIN SELECT ({sql})", {**probe, **params})
+            except Exception:
+                continue
+            columns.append(f"({sql}) AS {alias}")
+            self.aliases.append(alias)
+            self.params.update(params)
+        self.sql = "SELECT " + ", ".join(columns) if columns else None
+
+    def load(self, conn, year):
+        """
+        Alla evidensvärden för ett år i en enda fråga.
+        Returns:
+            dict: {alias: värde}; saknade källor finns inte med.
+        """
+        if self.sql is None:
+            return {}
+        row = conn.execute(self.sql, {"year": str(year), "year_int": int(year), **self.params}).fetchone()
+        return dict(zip(self.aliases, row))
+
+
+_compiled = {}
+
+
+def compile_rules(conn):
+    """
+    Kompilerade regler för anslutningens databas, cachade per schemaversion
+    så att kompileringen bara görs om när schemat ändras.
+    """
+    db_file = next((row[2] for row in conn.execute("PRAGMA database_list") if row[1] == "main"), "")
+    key = (db_file, conn.execute("PRAGMA schema_version").fetchone()[0])
+    compiled = _compiled.get(key)
+    if compiled is None:
+        compiled = _compiled[key] = CompiledRules(conn)
+    return compiled
+
+
+def _rule_for(code):
+    if code in RULES:
+        return code, RULES[code]
+    family = code.split("-")[0] + "*"
+    if family in RULES:
+        return family, RULES[family]
+    return None, None
+
+
+def evaluate(code, evidence, gap_status=None):
+    """
+    Status och kommentar för en kod utifrån förladdat underlag (inga frågor).
+    Args:
+        code (str): ESRS-kod.
+        evidence (dict): Resultatet av CompiledRules.load().
+        gap_status (str, optional): Status från f_GAP_Analysis.
+    Returns:
+        tuple: (status, kommentar).
+    """
+    key, rule = _rule_for(code)
+    result = (MISSING, "Ingen data.")
+
+    if rule is not None:
+        slug = key.replace("-", "_").replace("*", "_all")
+        if rule["kind"] == "value":
+            value = evidence.get(f"{slug}__0")
+            if value:
+                result = (REPORTED, rule["comment"].format(value=value))
+        else:
+            n_sources = len(rule["sources"]) if rule["kind"] == "count" else 1
+            counts = [evidence.get(f"{slug}__{i}") or 0 for i in range(n_sources)]
+            total = sum(counts)
+            complete = rule.get("complete", 1)
+            partial = rule.get("partial", complete)
+
+            if rule.get("mode") == "all":
+                covered = sum(1 for c in counts if c > 0)
+                if covered == n_sources:
+                    result = (REPORTED, rule["comment"].format(n=total))
+                elif covered > 0:
+                    result = (PARTIAL, f"Underlag finns för {covered} av {n_sources} källor.")
+            elif total >= complete:
+                result = (REPORTED, rule["comment"].format(n=total))
+            elif total > 0 and total >= partial:
+                result = (PARTIAL, rule["comment"].format(n=total))
+
+    if result[0] != REPORTED and gap_status in GAP_STATUS:
+        gap_result = GAP_STATUS[gap_status]
+        if result[0] == MISSING or gap_result[0] == REPORTED:
+            result = gap_result
+    return result
+
+
+def evaluate_year(year, conn=None):
+    """
+    Utvärderar alla ESRS-krav för ett rapportår.
+    Returns:
+        list: (esrs_code, disclosure_requirement, status, kommentar) per krav.
+    """
+    if conn is None:
+        with get_conn() as conn:
+            return evaluate_year(year, conn)
+
+    try:
+        _, reqs = queries.fetch_all("esrs_requirements", conn=conn)
+    except Exception:
+        # Ingen GAP-analys i databasen ännu
+        _, reqs = queries.fetch_all("esrs_requirements_no_gap", conn=conn)
+
+    evidence = compile_rules(conn).load(conn, year)
+    return [(code, req, *evaluate(code, evidence, gap)) for code, req, gap in reqs]
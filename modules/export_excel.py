@@ -1,56 +1,121 @@
-import pandas as pd
 import os
+import sqlite3
+import tempfile
+import xlsxwriter
 from datetime import datetime
 
-def create_audit_excel(conn, year):
+# Årsfilter per tabell. :year är rapportåret (int), :start/:end första dagen
+# i året respektive året efter, så att datumfiltren kan använda index.
+YEAR_COLUMN = "{col} = :year"
+DATE_COLUMN = "{col} >= :start AND {col} < :end"
+ACTIVE_ASSIGNMENT = "startdatum < :end AND (slutdatum IS NULL OR slutdatum >= :start)"
+
+# Tabell -> WHERE-villkor för rapportåret. Dimensionstabellerna begränsas
+# till de personer/kundsiter som förekommer i årets uppdrag.
+AUDIT_TABLES = {
+    'f_HR_Arsdata': YEAR_COLUMN.format(col='ar'),
+    'f_Pendling_Beraknad': f"uppdrag_id IN (SELECT uppdrag_id FROM f_Uppdrag WHERE {ACTIVE_ASSIGNMENT})",
+    'f_Drivmedel': DATE_COLUMN.format(col='datum'),
+    'f_Energi': YEAR_COLUMN.format(col='ar'),
+    'f_Governance_Inkop': YEAR_COLUMN.format(col='ar'),
+    'f_Vasentlighet': YEAR_COLUMN.format(col='ar'),
+    'f_Uppdrag': ACTIVE_ASSIGNMENT,
+    'd_Personal': f"person_id IN (SELECT person_id FROM f_Uppdrag WHERE {ACTIVE_ASSIGNMENT})",
+    'd_Kundsiter': f"kund_plats_id IN (SELECT kund_plats_id FROM f_Uppdrag WHERE {ACTIVE_ASSIGNMENT})",
+}
+
+CHUNK_SIZE = 5000
+
+def _write_rows(worksheet, row_index, rows):
+    for row in rows:
+        for col_index, value in enumerate(row):
+            if value is not None:
+                worksheet.write(row_index, col_index, value)
+        row_index += 1
+    return row_index
+
+def _export_table(conn, workbook, header_format, table, condition, params, chunk_size):
     """
-    Exporterar all relevant data för revision till en Excel-fil
+    Strömmar årets rader för en tabell till en egen flik (hoppas över om tom).
+
+    Bara en tabell som saknas i databasen hoppas över. Fel i årsfiltret
+    (t.ex. en omdöpt kolumn) avbryter exporten i stället för att tabellen
+    tyst utelämnas ur revisionsunderlaget.
     """
-    filename = f"ESG_Audit_{year}.xlsx" # Förenklat namn för enklare download handling
-    
-    # Lista på tabeller att exportera
-    tables = [
-        'f_HR_Arsdata',
-        'f_Pendling_Beraknad',
-        'f_Drivmedel',
-        'f_Energi',
-        'f_Governance_Inkop',
-        'f_Vasentlighet',
-        'f_Uppdrag',
-        'd_Personal',
-        'd_Kundsiter'
-    ]
-    
+    exists = conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type IN ('table', 'view') AND name = ?", (table,)
+    ).fetchone()
+    if not exists:
+        return 0
+
     try:
-        with pd.ExcelWriter(filename, engine='openpyxl') as writer:
-            # Översiktsflik
-            summary = pd.DataFrame({
-                'Rapport': ['ESG Audit Export'],
-                'År': [year],
-                'Genererad': [datetime.now().strftime('%Y-%m-%d %H:%M')],
-                'System': ['ESG Tool v2.0']
-            })
-            summary.to_excel(writer, sheet_name='Info', index=False)
-            
-            for table in tables:
-                try:
-                    # Läs data säkert
-                    query = f"SELECT * FROM {table}"
-                    
-                    # Försök filtrera på år om kolumnen finns (Detta är en förenkling, egentligen borde man kolla schema)
-                    # Här läser vi allt för audit trail, enklare och säkrare
-                    
-                    try:
-                        df = pd.read_sql(query, conn)
-                        if not df.empty:
-                            df.to_excel(writer, sheet_name=table[:31], index=False)
-                    except:
-                        pass # Tabellen kanske inte finns
-                        
-                except Exception as e:
-                    pass
+        cursor = conn.execute(f"SELECT * FROM {table} WHERE {condition}", params)
+    except sqlite3.Error as e:
+        raise sqlite3.OperationalError(f"Revisionsexporten kunde inte läsa {table}: {e}") from e
+
+    rows = cursor.fetchmany(chunk_size)
+    if not rows:
+        return 0
+
+    worksheet = workbook.add_worksheet(table[:31])
+    worksheet.write_row(0, 0, [d[0] for d in cursor.description], header_format)
+    row_index = 1
+    while rows:
+        row_index = _write_rows(worksheet, row_index, rows)
+        rows = cursor.fetchmany(chunk_size)
+    return row_index - 1
+
+def create_audit_excel(conn, year, output=None, chunk_size=CHUNK_SIZE, progress=None):
+    """
+    Exporterar rapportårets data för revision till en Excel-fil.
+
+    Årsfiltret läggs i SQL per tabell (AUDIT_TABLES) och raderna strömmas i
+    block till xlsxwriter i constant_memory-läge, så exporten för ett år inte
+    växer med databasens totala historik.
+    Args:
+        conn: Öppen databasanslutning.
+        year (int): Rapportår.
+        output (str|file, optional): Målfil eller buffert (t.ex. BytesIO).
+            Defaults to en ny temporär fil.
+        progress (callable, optional): Anropas med andel klar (0-1) efter varje tabell.
+    Returns:
+        str|file: Sökvägen (eller bufferten) med exporten, None om filen
+        inte kunde skrivas.
+    Raises:
+        sqlite3.Error: Om en befintlig tabell inte kunde läsas.
+    """
+    if output is None:
+        fd, output = tempfile.mkstemp(prefix=f"ESG_Audit_{year}_", suffix=".xlsx")
+        os.close(fd)
+
+    params = {
+        'year': int(year),
+        'start': f"{int(year):04d}-01-01",
+        'end': f"{int(year) + 1:04d}-01-01",
+    }
+
+    try:
+        workbook = xlsxwriter.Workbook(output, {'constant_memory': True})
+        header_format = workbook.add_format({'bold': True})
+
+        # Översiktsflik
+        info = workbook.add_worksheet('Info')
+        info.write_row(0, 0, ['Rapport', 'År', 'Genererad', 'System'], header_format)
+        info.write_row(1, 0, ['ESG Audit Export', int(year), datetime.now().strftime('%Y-%m-%d %H:%M'), 'ESG Tool v2.0'])
+
+        for i, (table, condition) in enumerate(AUDIT_TABLES.items(), start=1):
+            _export_table(conn, workbook, header_format, table, condition, params, chunk_size)
+            if progress:
+                progress(i / (len(AUDIT_TABLES) + 1))
+
+        workbook.close()
+    except sqlite3.Error:
+        raise
     except Exception as e:
         # Fallback om något går fel (t.ex. permissions)
+        print(f"Error generating audit export: {e}")
         return None
-                
-    return filename
+
+    if hasattr(output, 'seek'):
+        output.seek(0)
+    return output
@@ -1,43 +1,54 @@
 import pandas as pd
-import streamlit as st
-import sqlite3
-import os
 from datetime import datetime, timedelta
+from modules.db import get_conn
+from modules.query_cache import cached_query, invalidate
 
-def get_conn():
-    path = "database/esg_index.db"
-    if not os.path.exists(path) and os.path.exists(f"../{path}"): path = f"../{path}"
-    return sqlite3.connect(path)
-
-@st.cache_data(ttl=60)
+@cached_query(['f_Governance_Policies'])
 def get_policies():
     try:
         with get_conn() as conn:
             return pd.read_sql("SELECT * FROM f_Governance_Policies ORDER BY next_review_date ASC", conn)
     except: return pd.DataFrame()
 
-def add_policy(name, version, owner, last_updated, esrs_req, doc_link=None):
+def _policy_row(name, version, owner, last_updated, esrs_req, doc_link=None):
     if isinstance(last_updated, str):
         date_obj = datetime.strptime(last_updated, '%Y-%m-%d')
     else:
         date_obj = datetime.combine(last_updated, datetime.min.time())
         
     next_review = date_obj + timedelta(days=365)
-    
+    return (name, version, owner, date_obj.strftime('%Y-%m-%d'), next_review.strftime('%Y-%m-%d'), esrs_req, doc_link)
+
+POLICY_INSERT = """
+    INSERT INTO f_Governance_Policies 
+    (policy_name, document_version, owner, last_updated, next_review_date, esrs_requirement, is_implemented, document_link) 
+    VALUES (?, ?, ?, ?, ?, ?, 1, ?)
+"""
+
+def add_policy(name, version, owner, last_updated, esrs_req, doc_link=None):
     with get_conn() as conn:
-        conn.execute("""
-            INSERT INTO f_Governance_Policies 
-            (policy_name, document_version, owner, last_updated, next_review_date, esrs_requirement, is_implemented, document_link) 
-            VALUES (?, ?, ?, ?, ?, ?, 1, ?)
-        """, (name, version, owner, date_obj.strftime('%Y-%m-%d'), next_review.strftime('%Y-%m-%d'), esrs_req, doc_link))
+        conn.execute(POLICY_INSERT, _policy_row(name, version, owner, last_updated, esrs_req, doc_link))
+        conn.commit()
+    invalidate('f_Governance_Policies')
+
+def add_policies(records):
+    """
+    Adds many policies in one transaction.
+    Args:
+        records (iterable): Dicts with add_policy()'s argument names or tuples in the same order.
+    """
+    rows = [_policy_row(**r) if isinstance(r, dict) else _policy_row(*r) for r in records]
+    with get_conn() as conn:
+        conn.executemany(POLICY_INSERT, rows)
         conn.commit()
-    st.cache_data.clear()
+    invalidate('f_Governance_Policies')
+    return len(rows)
 
 def delete_policy(policy_id):
     with get_conn() as conn:
         conn.execute("DELETE FROM f_Governance_Policies WHERE id = ?", (policy_id,))
         conn.commit()
-    st.cache_data.clear()
+    invalidate('f_Governance_Policies')
 
 # --- GAP ANALYSIS FUNCTIONS ---
 
@@ -75,7 +86,7 @@ def update_gap_status(esrs_code, status, owner=None, link=None, notes=None):
                 last_updated = excluded.last_updated
         """, (esrs_code, status, owner, link, notes, datetime.now().strftime('%Y-%m-%d')))
         conn.commit()
-    st.cache_data.clear()
+    invalidate('f_GAP_Analysis')
 
 def get_readiness_kpis():
     """
@@ -0,0 +1,205 @@
+"""
+Versioned schema migrations for esg_index.db.
+
+Each migration has a version number and runs once, in its own
+transaction, in version order. The applied version is stored in
+PRAGMA user_version (cheap to read on startup) and every applied step is
+logged in system_schema_migrations.
+
+New schema changes are added as a new entry at the end of MIGRATIONS;
+existing entries are never edited once released.
+
+Startup uses the stored version to skip bootstrap DDL: is_current() is
+checked once per process and database file (re-checked only when the
+file's mtime changes), and init_db/ensure_* do nothing when it is true.
+Adding a migration therefore also re-runs the idempotent bootstrap once.
+"""
+import os
+
+# (indexnamn, tabell, kolumner/uttryck). Årsfilter på datumtext görs som
+# index på exakt samma uttryck som frågorna använder (strftime('%Y', ...)),
+# vilket är det SQLite-planeraren matchar; datumintervall använder indexet
+# på själva datumkolumnen.
+INDEXES_V1 = [
+    # Spend-sammanställning och produktlista per period (täckande)
+    ("idx_scope3_calc_period", "f_Scope3_Calculations", "reporting_period, category, spend_sek, co2e_tonnes"),
+    ("idx_scope3_calc_period_product", "f_Scope3_Calculations", "reporting_period, product_name, category, co2e_tonnes"),
+    # Scope 1 per år (ESRS-index) och per datumintervall (revisionsexport)
+    ("idx_drivmedel_year", "f_Drivmedel", "strftime('%Y', datum), co2_kg"),
+    ("idx_drivmedel_datum", "f_Drivmedel", "datum"),
+    ("idx_energi_ar", "f_Energi", "ar, el_kalla"),
+    ("idx_vasentlighet_ar", "f_Vasentlighet", "ar"),
+    # Vatten/avfall: årsfilter (ESRS-index) och datumintervall (PDF, revision)
+    ("idx_water_year", "f_Water_Data", "strftime('%Y', date)"),
+    ("idx_water_date", "f_Water_Data", "date, consumption_m3"),
+    ("idx_waste_year", "f_Waste_Detailed", "strftime('%Y', date)"),
+    ("idx_waste_date", "f_Waste_Detailed", "date, weight_kg"),
+    ("idx_dma_iro_topic", "f_DMA_IRO", "dma_topic_id"),
+    ("idx_gov_policies_esrs", "f_Governance_Policies", "esrs_requirement"),
+    # Pendling: uppslag från personal/kundsiter och beräkningar per uppdrag
+    ("idx_uppdrag_person", "f_Uppdrag", "person_id"),
+    ("idx_uppdrag_kund_plats", "f_Uppdrag", "kund_plats_id"),
+    ("idx_pendling_uppdrag", "f_Pendling_Beraknad", "uppdrag_id"),
+]
+
+
+def _create_indexes(indexes):
+    def step(conn):
+        existing = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+        for name, table, columns in indexes:
+            # Tabeller som inte finns i den här databasen hoppas över
+            if table in existing:
+                conn.execute(f"CREATE INDEX IF NOT EXISTS {name} ON {table} ({columns})")
+    return step
+
+
+def _create_entity_dimension(conn):
+    # Koncernens bolag; moderbolagets data ligger i den här databasen (db_file NULL)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS d_Entity (
+            entity_id TEXT PRIMARY KEY,
+            name TEXT NOT NULL,
+            org_nr TEXT,
+            parent_id TEXT REFERENCES d_Entity(entity_id),
+            ownership_pct REAL NOT NULL DEFAULT 100,
+            consolidation_method TEXT NOT NULL DEFAULT 'operational_control',
+            db_file TEXT,
+            is_active INTEGER NOT NULL DEFAULT 1,
+            created_at TEXT DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+    conn.execute("INSERT OR IGNORE INTO d_Entity (entity_id, name) VALUES ('parent', 'Moderbolag')")
+
+
+def _reset_spend_factor_on_category_change(conn):
+    # Ny kategori utan ny faktor: nollställ faktorn så att change_log.process_changes()
+    # hämtar kategorins faktor och räknar om co2e_tonnes
+    if not conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'f_Scope3_Calculations'").fetchone():
+        return
+    conn.execute("""
+        CREATE TRIGGER IF NOT EXISTS trg_f_Scope3_Calculations_factor_reset
+        AFTER UPDATE OF category ON f_Scope3_Calculations
+        WHEN NEW.category IS NOT OLD.category AND NEW.emission_factor IS OLD.emission_factor
+        BEGIN
+            UPDATE f_Scope3_Calculations SET emission_factor = NULL WHERE id = NEW.id;
+        END
+    """)
+
+
+def _create_table_versioning(conn):
+    # Ändringsräknare per faktatabell/dimension för artefaktcachen och Parquet-
+    # ögonblicksbilderna. Triggern upsertar, så räknaren fungerar även i bolagsfiler
+    # där triggern kopierats utan räknarrader. Äldre triggers (utan upsert) ersätts.
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS system_table_versions (
+            table_name TEXT PRIMARY KEY,
+            version INTEGER NOT NULL DEFAULT 0
+        )
+    """)
+    tables = [row[0] for row in conn.execute(
+        "SELECT name FROM sqlite_master WHERE type = 'table' AND substr(name, 1, 2) IN ('f_', 'd_')")]
+    for table in tables:
+        conn.execute("INSERT OR IGNORE INTO system_table_versions (table_name) VALUES (?)", (table,))
+        bump = f"""
+            INSERT INTO system_table_versions (table_name, version) VALUES ('{table}', 1)
+            ON CONFLICT(table_name) DO UPDATE SET version = version + 1;
+        """
+        for suffix, event in (("ins", "INSERT"), ("upd", "UPDATE"), ("del", "DELETE")):
+            conn.execute(f"DROP TRIGGER IF EXISTS trg_{table}_ver_{suffix}")
+            conn.execute(f"CREATE TRIGGER trg_{table}_ver_{suffix} AFTER {event} ON {table} BEGIN {bump} END")
+
+
+# (version, beskrivning, steg). Steget får anslutningen och körs i en transaktion.
+MIGRATIONS = [
+    (1, "Täckande index för rapportårsfilter och uppslag", _create_indexes(INDEXES_V1)),
+    (2, "Bolagsdimension (d_Entity) för koncernrapportering", _create_entity_dimension),
+    (3, "Ny Scope 3-faktor när en spend-rads kategori ändras", _reset_spend_factor_on_category_change),
+    (4, "Ändringsräknare (system_table_versions) för cache och ögonblicksbilder", _create_table_versioning),
+]
+
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+
+
+def current_version(conn):
+    """Databasens schemaversion (0 = inga migreringar körda)."""
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+# Databasfil -> filsignatur när den senast konstaterades vara aktuell
+_verified = {}
+
+
+def _db_file(conn):
+    return next((row[2] for row in conn.execute("PRAGMA database_list") if row[1] == "main"), "")
+
+
+def _file_signature(path):
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return (st.st_ino, st.st_mtime_ns)
+
+
+def is_current(conn):
+    """
+    True om databasen redan har SCHEMA_VERSION, dvs. all bootstrap-DDL kan
+    hoppas över. Utan fråga mot databasen så länge filen är oförändrad sedan
+    den senast kontrollerades i den här processen.
+    """
+    path = _db_file(conn)
+    signature = _file_signature(path) if path else None
+    if signature is not None and _verified.get(path) == signature:
+        return True
+    if current_version(conn) < SCHEMA_VERSION:
+        return False
+    if signature is not None:
+        _verified[path] = signature
+    return True
+
+
+def migrate(conn, target=None):
+    """
+    Kör alla migreringar som inte redan körts, i versionsordning.
+    Args:
+        conn: Öppen databasanslutning.
+        target (int, optional): Högsta version att migrera till. Defaults to SCHEMA_VERSION.
+    Returns:
+        list: Versionerna som kördes (tom om databasen redan var aktuell).
+    Raises:
+        Exception: Om ett steg misslyckas; det stegets ändringar rullas tillbaka.
+    """
+    target = SCHEMA_VERSION if target is None else target
+    version = current_version(conn)
+    if version >= target:
+        return []
+
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS system_schema_migrations (
+            version INTEGER PRIMARY KEY,
+            description TEXT,
+            applied_at TEXT DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+    conn.commit()
+
+    applied = []
+    for number, description, step in MIGRATIONS:
+        if number <= version or number > target:
+            continue
+        conn.execute("BEGIN")
+        try:
+            step(conn)
+            conn.execute("INSERT OR REPLACE INTO system_schema_migrations (version, description) VALUES (?, ?)",
+                         (number, description))
+            conn.execute(f"PRAGMA user_version = {int(number)}")
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        applied.append(number)
+
+    if applied:
+        # Uppdatera planerarens statistik för de nya indexen
+        conn.execute("PRAGMA optimize")
+    return applied
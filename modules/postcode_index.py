@@ -0,0 +1,196 @@
+"""
+Offline index of Swedish postal-code centroids.
+
+The index is stored column-wise as .npy files (sorted postal codes, lat, lon)
+and opened memory-mapped, so thousands of commute distances can be computed
+in one vectorized haversine pass without any network calls.
+
+Build it once with build_index(), either from a GeoNames postal-code dump
+(https://download.geonames.org/export/zip/SE.zip, CC BY 4.0) or from the
+postal codes already geocoded into distance_api's geo_cache.
+"""
+import csv
+import os
+import numpy as np
+from modules import db
+
+INDEX_DIR = os.path.join(os.path.dirname(db.DB_PATH), "postcode_index")
+EARTH_RADIUS_KM = 6371
+
+_index = None
+
+
+def normalize_postcodes(postnummer):
+    """
+    Postnummer som int-array ("581 83" -> 58183). Ogiltiga blir -1.
+    Args:
+        postnummer (iterable): Postnummer som str/int.
+    Returns:
+        np.ndarray: int32-array i samma ordning.
+    """
+    out = np.full(len(postnummer), -1, dtype=np.int32)
+    for i, pnr in enumerate(postnummer):
+        digits = str(pnr).replace(" ", "").strip()
+        if digits.isdigit():
+            out[i] = int(digits)
+    return out
+
+
+class PostcodeIndex:
+    """Sorted postal codes with centroid coordinates."""
+
+    def __init__(self, codes, lat, lon):
+        self.codes = codes
+        self.lat = lat
+        self.lon = lon
+
+    def __len__(self):
+        return len(self.codes)
+
+    def lookup(self, postnummer):
+        """
+        Koordinater för många postnummer i ett svep.
+        Returns:
+            tuple: (lat, lon) float64-arrayer, NaN där postnumret saknas.
+        """
+        codes = normalize_postcodes(postnummer)
+        lat = np.full(len(codes), np.nan)
+        lon = np.full(len(codes), np.nan)
+        if len(self.codes) == 0:
+            return lat, lon
+
+        pos = np.searchsorted(self.codes, codes)
+        pos = np.clip(pos, 0, len(self.codes) - 1)
+        found = self.codes[pos] == codes
+        lat[found] = self.lat[pos[found]]
+        lon[found] = self.lon[pos[found]]
+        return lat, lon
+
+
+def haversine_km(lat1, lon1, lat2, lon2):
+    """Vektoriserad fågelvägsdistans i km (NaN propageras)."""
+    lat1, lon1, lat2, lon2 = (np.radians(np.asarray(a, dtype=float)) for a in (lat1, lon1, lat2, lon2))
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(a))
+
+
+def load_index(index_dir=None):
+    """
+    Öppnar indexet memory-mappat (cachat per process).
+    Returns:
+        PostcodeIndex | None: None om indexet inte har byggts.
+    """
+    global _index
+    if index_dir is None and _index is not None:
+        return _index
+
+    path = index_dir or INDEX_DIR
+    files = [os.path.join(path, f"{name}.npy") for name in ("codes", "lat", "lon")]
+    if not all(os.path.exists(f) for f in files):
+        return None
+
+    index = PostcodeIndex(*(np.load(f, mmap_mode="r") for f in files))
+    if index_dir is None:
+        _index = index
+    return index
+
+
+def require_index():
+    """
+    Som load_index(), men ett saknat eller tomt index är ett fel.
+    Raises:
+        FileNotFoundError: Indexet har inte byggts med build_index().
+    """
+    index = load_index()
+    if index is None or len(index) == 0:
+        raise FileNotFoundError(
+            f"Postnummerindexet saknas i {INDEX_DIR}. Bygg det med postcode_index.build_index() "
+            "eller använd distansbackend 'osm'/'auto'."
+        )
+    return index
+
+
+def _read_geonames(path):
+    # GeoNames zip-format: landskod, postnummer, ort, ..., lat (kol 9), lon (kol 10)
+    with open(path, encoding="utf-8") as f:
+        for row in csv.reader(f, delimiter="\t"):
+            if len(row) > 10 and row[0] == "SE":
+                yield row[1], float(row[9]), float(row[10])
+
+
+def _read_csv(path):
+    # Enkel CSV med kolumnerna postnummer, lat, lon
+    with open(path, encoding="utf-8", newline="") as f:
+        for row in csv.DictReader(f):
+            yield row["postnummer"], float(row["lat"]), float(row["lon"])
+
+
+def _read_geo_cache():
+    from modules import distance_api
+    with distance_api._cache_conn() as conn:
+        yield from conn.execute("SELECT postnummer, lat, lon FROM geo_cache WHERE lat IS NOT NULL").fetchall()
+
+
+def build_index(source=None, index_dir=None):
+    """
+    Bygger det kolumnära indexet.
+    Args:
+        source (str, optional): GeoNames SE.txt eller CSV (postnummer, lat, lon).
+            Utan källa byggs indexet från distance_api:s geo_cache.
+        index_dir (str, optional): Målkatalog. Defaults to INDEX_DIR.
+    Returns:
+        int: Antal postnummer i indexet.
+    """
+    global _index
+    if source is None:
+        rows = _read_geo_cache()
+    elif source.endswith(".txt"):
+        rows = _read_geonames(source)
+    else:
+        rows = _read_csv(source)
+
+    # Samma postnummer kan förekomma flera gånger (flera orter) -> medelvärde
+    sums = {}
+    for pnr, lat, lon in rows:
+        code = normalize_postcodes([pnr])[0]
+        if code < 0:
+            continue
+        s = sums.setdefault(int(code), [0.0, 0.0, 0])
+        s[0] += lat
+        s[1] += lon
+        s[2] += 1
+
+    if not sums:
+        raise ValueError("Inga giltiga postnummer i källan; indexet byggs inte")
+
+    codes = np.array(sorted(sums), dtype=np.int32)
+    lat = np.array([sums[c][0] / sums[c][2] for c in codes], dtype=np.float64)
+    lon = np.array([sums[c][1] / sums[c][2] for c in codes], dtype=np.float64)
+
+    path = index_dir or INDEX_DIR
+    os.makedirs(path, exist_ok=True)
+    for name, arr in (("codes", codes), ("lat", lat), ("lon", lon)):
+        np.save(os.path.join(path, f"{name}.npy"), arr)
+
+    if index_dir is None:
+        _index = None  # Öppna om vid nästa load_index()
+    return len(codes)
+
+
+def distances_km(postnummer_from, postnummer_to, detour_factor=1.3, index=None):
+    """
+    Uppskattad bilvägsdistans (fågelväg × omvägsfaktor) för par av postnummer.
+    Args:
+        postnummer_from (iterable): Startpostnummer.
+        postnummer_to (iterable): Målpostnummer, samma längd.
+        detour_factor (float): Omvägsfaktor. Defaults to 1.3.
+    Returns:
+        np.ndarray: km per par, NaN där något postnummer saknas i indexet.
+    """
+    index = index or load_index()
+    if index is None:
+        return np.full(len(postnummer_from), np.nan)
+
+    lat1, lon1 = index.lookup(postnummer_from)
+    lat2, lon2 = index.lookup(postnummer_to)
+    return haversine_km(lat1, lon1, lat2, lon2) * detour_factor
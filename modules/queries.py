@@ -0,0 +1,138 @@
+"""
+Named, parameterized read queries.
+
+Dashboard readers run their SQL by name instead of formatting values into
+the statement text. The text of a named query never changes, so SQLite's
+per-connection statement cache (see db.CACHED_STATEMENTS) compiles it once
+and reuses the prepared plan for every year/period. Each execution is timed
+into a per-statement registry that timings() reports.
+"""
+import threading
+import time
+from contextlib import contextmanager
+
+import pandas as pd
+
+from modules.db import get_conn
+
+# namn -> SQL med namngivna parametrar (:namn). Texten får aldrig byggas dynamiskt.
+QUERIES = {
+    "spend_summary": """
+        SELECT category, SUM(spend_sek) AS total_sek, SUM(co2e_tonnes) AS total_co2
+        FROM f_Scope3_Calculations
+        WHERE reporting_period = :period
+        GROUP BY category
+        ORDER BY category
+    """,
+    "product_breakdown": """
+        SELECT product_name, category, SUM(co2e_tonnes) AS co2
+        FROM f_Scope3_Calculations
+        WHERE reporting_period = :period AND product_name != ''
+        GROUP BY product_name, category
+        ORDER BY co2 DESC
+    """,
+    "hr_summary": "SELECT * FROM f_HR_Arsdata WHERE ar = :year",
+    "water_totals": """
+        SELECT COUNT(*) AS records,
+               COALESCE(SUM(withdrawal_m3), 0) AS total_withdrawal,
+               COALESCE(SUM(consumption_m3), 0) AS total_consumption,
+               COALESCE(SUM(recycled_m3), 0) AS total_recycled
+        FROM f_Water_Data
+    """,
+    "scope_category_totals": """
+        SELECT scope, category, SUM(co2_ton) AS co2_ton
+        FROM f_Emissions_Summary
+        GROUP BY scope, category
+    """,
+    "scope_category_totals_period": """
+        SELECT scope, category, SUM(co2_ton) AS co2_ton
+        FROM f_Emissions_Summary
+        WHERE period = :period
+        GROUP BY scope, category
+    """,
+    "esrs_requirements": """
+        SELECT r.esrs_code, r.disclosure_requirement, g.status
+        FROM f_ESRS_Requirements r
+        LEFT JOIN f_GAP_Analysis g ON r.esrs_code = g.esrs_code
+        ORDER BY r.rowid
+    """,
+    "esrs_requirements_no_gap": """
+        SELECT esrs_code, disclosure_requirement, NULL AS status
+        FROM f_ESRS_Requirements
+        ORDER BY rowid
+    """,
+}
+
+# namn -> [antal körningar, total tid (s), längsta tid (s)]
+_timings = {}
+_timings_lock = threading.Lock()
+
+
+@contextmanager
+def timed(name):
+    """Mäter ett block in i körstatistiken under namnet."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        with _timings_lock:
+            entry = _timings.setdefault(name, [0, 0.0, 0.0])
+            entry[0] += 1
+            entry[1] += elapsed
+            entry[2] = max(entry[2], elapsed)
+
+
+def _sql(name):
+    try:
+        return QUERIES[name]
+    except KeyError:
+        raise ValueError(f"Okänd fråga: {name}") from None
+
+
+def fetch_all(name, params=None, conn=None):
+    """
+    Kör en namngiven fråga.
+    Args:
+        name (str): Nyckel i QUERIES.
+        params (dict, optional): Värden för frågans :parametrar.
+        conn (optional): Öppen anslutning. Defaults to en poolad anslutning.
+    Returns:
+        tuple: (kolumnnamn, rader).
+    """
+    if conn is None:
+        with get_conn() as conn:
+            return fetch_all(name, params, conn)
+    sql = _sql(name)
+    with timed(name):
+        cursor = conn.execute(sql, params or {})
+        rows = cursor.fetchall()
+    return [d[0] for d in cursor.description], rows
+
+
+def read_df(name, params=None, conn=None):
+    """Som fetch_all(), men som DataFrame."""
+    columns, rows = fetch_all(name, params, conn)
+    return pd.DataFrame(rows, columns=columns)
+
+
+def timings():
+    """
+    Körstatistik per namngiven fråga i den här processen, långsammast först.
+    Returns:
+        pd.DataFrame: query, calls, total_ms, avg_ms, max_ms.
+    """
+    with _timings_lock:
+        snapshot = {name: list(entry) for name, entry in _timings.items()}
+    df = pd.DataFrame(
+        [(name, calls, total * 1000, total * 1000 / calls, longest * 1000)
+         for name, (calls, total, longest) in snapshot.items()],
+        columns=["query", "calls", "total_ms", "avg_ms", "max_ms"],
+    )
+    return df.sort_values("total_ms", ascending=False, ignore_index=True)
+
+
+def reset_timings():
+    """Nollställer körstatistiken."""
+    with _timings_lock:
+        _timings.clear()
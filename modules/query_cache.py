@@ -0,0 +1,42 @@
+"""
+Table-tagged query cache.
+
+Readers declare which tables their result depends on; writers invalidate
+only those tables. This replaces global st.cache_data.clear() calls, which
+dropped every cached query for every session on each save.
+"""
+import streamlit as st
+
+# tabell -> {"modul.funktion": cachad funktion}
+# Nycklat på namn så att importlib.reload() ersätter i stället för att lägga till
+_registry = {}
+
+
+def cached_query(tables, ttl=60):
+    """
+    Som st.cache_data(ttl=...), men taggad med tabellerna resultatet läser.
+    Args:
+        tables (list): Tabeller som funktionen läser från.
+        ttl (int): Sekunder innan cachen går ut oavsett skrivningar.
+    """
+    def decorator(func):
+        cached = st.cache_data(ttl=ttl)(func)
+        key = f"{func.__module__}.{func.__qualname__}"
+        for table in tables:
+            _registry.setdefault(table, {})[key] = cached
+        return cached
+    return decorator
+
+
+def invalidate(*tables):
+    """Tömmer cachen för alla läsare som beror på någon av tabellerna."""
+    cleared = {}
+    for table in tables:
+        cleared.update(_registry.get(table, {}))
+    for cached in cleared.values():
+        cached.clear()
+
+
+def dependents(table):
+    """Namnen på de cachade läsare som beror på en tabell."""
+    return sorted(_registry.get(table, {}))
@@ -1,6 +1,7 @@
-import pandas as pd
-import sqlite3
 import os
+import tempfile
+import pandas as pd
+import xlsxwriter
 from io import BytesIO
 from fpdf import FPDF
 
@@ -8,150 +9,295 @@ from fpdf import FPDF
 from modules import scope3_travel
 from modules import scope3_waste
 from modules import scope3_purchased_goods
+from modules import db
+from modules import artifact_cache
+from modules import emissions_summary
+from modules import snapshots
+
+def get_db_connection(db_path=None):
+    """Returns a pooled connection to the SQLite database."""
+    return db.get_conn(db_path)
+
+# Flikar i rapporten: (fliknamn, tabell). Läses i block så att hela
+# tabeller aldrig hålls i minnet samtidigt.
+REPORT_SHEETS = [
+    ('Scope 1 - Fuel', 'f_Drivmedel'),
+    ('Scope 2 - Energy', 'f_Energi'),
+    ('Scope 3 - Travel', 'f_Scope3_BusinessTravel'),
+    ('Scope 3 - Purchases', 'f_Scope3_PurchasedGoodsServices'),
+    ('Env - Water (E3)', 'f_Water_Data'),
+    ('Env - Waste (E5)', 'f_Waste_Detailed'),
+]
+
+CHUNK_SIZE = 5000
+
+# Alla tabeller rapporten läser (flikar + sammanfattning), för artefaktcachen
+SOURCE_TABLES = [table for _, table in REPORT_SHEETS] + ['f_Emissions_Summary']
+
+def _table_columns(conn, table):
+    return [row[1] for row in conn.execute(f"PRAGMA table_info({table})")]
 
-def get_db_connection(db_path="database/esg_index.db"):
-    """Establish connection to the SQLite database."""
-    # Ensure directory exists if we are running from root
-    if not os.path.exists(db_path):
-        # Fallback logic or error handling
-        # Try finding it relative to current file if needed
-        base_dir = os.path.dirname(os.path.dirname(__file__))
-        alt_path = os.path.join(base_dir, "database", "esg_index.db")
-        if os.path.exists(alt_path):
-            return sqlite3.connect(alt_path)
-    return sqlite3.connect(db_path)
+def _sum(conn, table, *columns):
+    """SUM av första befintliga kolumnen; 0 om tabell/kolumn saknas."""
+    existing = _table_columns(conn, table)
+    for column in columns:
+        if column in existing:
+            return conn.execute(f"SELECT COALESCE(SUM({column}), 0) FROM {table}").fetchone()[0]
+    return 0
+
+def get_report_summary(conn) -> pd.DataFrame:
+    """
+    Sammanfattningsfliken beräknad med SQL-aggregat (inga tabeller läses in).
+    Utsläppen tas ur f_Emissions_Summary, så Scope 3 räknas som i översikten och PDF:en.
+    """
+    emissions_summary.ensure_summary(conn)
+    scope1, scope2, scope3 = emissions_summary.get_scope_totals(conn)
+    return pd.DataFrame({
+        "Category": ["Scope 1 (Direct)", "Scope 2 (Energy)", "Scope 3 (Value Chain)", "Total Water Consumption (m3)", "Total Waste (kg)"],
+        "Value": [
+            scope1 * 1000,
+            scope2 * 1000,
+            scope3 * 1000,
+            _sum(conn, 'f_Water_Data', 'consumption_m3'),
+            _sum(conn, 'f_Waste_Detailed', 'weight_kg'),
+        ],
+        "Unit": ["kg CO2e", "kg CO2e", "kg CO2e", "m3", "kg"]
+    })
+
+def _write_rows(worksheet, row_index, rows):
+    for row in rows:
+        for col_index, value in enumerate(row):
+            if value is not None:
+                worksheet.write(row_index, col_index, value)
+        row_index += 1
+    return row_index
+
+def _stream_table(conn, worksheet, header_format, table, chunk_size, use_snapshots=True):
+    """
+    Skriver en tabell i block: ur Parquet-ögonblicksbilden om den är aktuell
+    (och gäller den här databasen), annars från en cursor (fetchmany).
+    """
+    snapshot = snapshots.scan(table, chunk_size) if use_snapshots else None
+    if snapshot is not None:
+        columns, chunks = snapshot
+    else:
+        try:
+            cursor = conn.execute(f"SELECT * FROM {table}")
+        except Exception:
+            return # Tabellen finns inte i den här databasen
+        columns = [d[0] for d in cursor.description]
+        chunks = iter(lambda: cursor.fetchmany(chunk_size), [])
+    worksheet.write_row(0, 0, columns, header_format)
+    row_index = 1
+    for rows in chunks:
+        row_index = _write_rows(worksheet, row_index, rows)
+
+def write_csrd_report(path=None, chunk_size=CHUNK_SIZE, progress=None, db_path=None) -> str:
+    """
+    Skriver CSRD-rapporten direkt till fil i strömmande läge.
+
+    Varje flik läses via en cursor i block om chunk_size rader och skrivs med
+    xlsxwriters constant_memory, så minnesåtgången är oberoende av hur många
+    år databasen innehåller.
+    Args:
+        path (str, optional): Målfil. Defaults to en ny temporär fil.
+        chunk_size (int): Rader per fetchmany().
+        progress (callable, optional): Anropas med andel klar (0-1) efter varje flik.
+        db_path (str, optional): Databasfilen (t.ex. i en arbetsprocess). Defaults to DB_PATH.
+    Returns:
+        str: Sökvägen till den färdiga .xlsx-filen (anroparen tar bort den).
+    """
+    if path is None:
+        fd, path = tempfile.mkstemp(prefix="CSRD_Report_", suffix=".xlsx")
+        os.close(fd)
+
+    workbook = xlsxwriter.Workbook(path, {'constant_memory': True})
+    header_format = workbook.add_format({'bold': True})
+    # Ögonblicksbilderna ligger bredvid DB_PATH och gäller bara den filen
+    use_snapshots = db_path is None or os.path.abspath(db_path) == db.DB_PATH
+
+    with get_db_connection(db_path) as conn:
+        try:
+            summary_df = get_report_summary(conn)
+            summary = workbook.add_worksheet('CSRD Summary')
+            summary.write_row(0, 0, list(summary_df.columns), header_format)
+            _write_rows(summary, 1, summary_df.itertuples(index=False))
+
+            for i, (sheet_name, table) in enumerate(REPORT_SHEETS, start=1):
+                _stream_table(conn, workbook.add_worksheet(sheet_name), header_format, table, chunk_size, use_snapshots)
+                if progress:
+                    progress(i / (len(REPORT_SHEETS) + 1))
+
+        except Exception as e:
+            print(f"Error generating report: {e}")
+            error_sheet = workbook.add_worksheet('Error')
+            error_sheet.write_row(0, 0, ["Error", str(e)])
+
+    workbook.close()
+    return path
 
 def generate_csrd_report() -> BytesIO:
     """
     Generates a CSRD-compliant Excel report with Scope 1, 2, 3, Water, and Waste detailed data.
+    Built with write_csrd_report() and served from the artifact cache while
+    the source tables are unchanged.
     Returns:
         BytesIO: The Excel file in memory.
     """
-    output = BytesIO()
-    writer = pd.ExcelWriter(output, engine='xlsxwriter')
-    
-    conn = get_db_connection()
-    
-    try:
-        # --- Scope 1 & 2 ---
-        try: scope1_df = pd.read_sql("SELECT * FROM f_Drivmedel", conn)
-        except Exception: scope1_df = pd.DataFrame(columns=["co2_kg"])
-            
-        try: scope2_df = pd.read_sql("SELECT * FROM f_Energi", conn) 
-        except Exception: scope2_df = pd.DataFrame(columns=["co2_kg"])
-
-        # --- Scope 3 Data ---
-        try: scope3_bus_travel_df = pd.read_sql("SELECT * FROM f_Scope3_BusinessTravel", conn)
-        except Exception: scope3_bus_travel_df = pd.DataFrame(columns=["co2_kg"])
-
-        try: scope3_purchased_goods_df = pd.read_sql("SELECT * FROM f_Scope3_PurchasedGoodsServices", conn)
-        except Exception: scope3_purchased_goods_df = pd.DataFrame(columns=["co2_kg"])
-            
-        # --- New Environmental Modules ---
-        try: water_df = pd.read_sql("SELECT * FROM f_Water_Data", conn)
-        except Exception: water_df = pd.DataFrame()
-            
-        try: waste_detailed_df = pd.read_sql("SELECT * FROM f_Waste_Detailed", conn)
-        except Exception: waste_detailed_df = pd.DataFrame()
-        
-        # Legacy Waste (for backward compatibility if needed)
-        try: scope3_waste_df = pd.read_sql("SELECT * FROM f_Scope3_Waste", conn)
-        except Exception: scope3_waste_df = pd.DataFrame(columns=["co2_kg"])
-
-        # Totals
-        total_scope3 = (
-            scope3_bus_travel_df["co2_kg"].sum() +
-            scope3_purchased_goods_df["co2_kg"].sum() +
-            scope3_waste_df["co2_kg"].sum() # Include legacy waste emission calc if exists
-        )
-
-        # --- Summary Sheet ---
-        summary_data = {
-            "Category": ["Scope 1 (Direct)", "Scope 2 (Energy)", "Scope 3 (Value Chain)", "Total Water Consumption (m3)", "Total Waste (kg)"],
-            "Value": [
-                scope1_df["co2_kg"].sum(),
-                scope2_df.get("scope2_market_based_kg", scope2_df.get("co2_kg", pd.Series([0]))).sum(), # Handle schema variations
-                total_scope3,
-                water_df["consumption_m3"].sum() if not water_df.empty else 0,
-                waste_detailed_df["weight_kg"].sum() if not waste_detailed_df.empty else 0
-            ],
-            "Unit": ["kg CO2e", "kg CO2e", "kg CO2e", "m3", "kg"]
-        }
-        summary_df = pd.DataFrame(summary_data)
-        
-        # Write to Excel
-        summary_df.to_excel(writer, sheet_name='CSRD Summary', index=False)
-        scope1_df.to_excel(writer, sheet_name='Scope 1 - Fuel', index=False)
-        scope2_df.to_excel(writer, sheet_name='Scope 2 - Energy', index=False)
-        scope3_bus_travel_df.to_excel(writer, sheet_name='Scope 3 - Travel', index=False)
-        scope3_purchased_goods_df.to_excel(writer, sheet_name='Scope 3 - Purchases', index=False)
-        water_df.to_excel(writer, sheet_name='Env - Water (E3)', index=False)
-        waste_detailed_df.to_excel(writer, sheet_name='Env - Waste (E5)', index=False)
-        
-    except Exception as e:
-        print(f"Error generating report: {e}")
-        pd.DataFrame({"Error": [str(e)]}).to_excel(writer, sheet_name='Error')
-    finally:
-        conn.close()
-        
-    writer.close()
-    output.seek(0)
-    return output
+    path = artifact_cache.get_or_build("csrd_excel", SOURCE_TABLES, lambda p: write_csrd_report(p), suffix=".xlsx")
+    with open(path, 'rb') as f:
+        return BytesIO(f.read())
+
+# --- PDF-sammanfattning ---
+
+# Tabeller som PDF-aggregaten läser (för artefaktcachen)
+PDF_SOURCE_TABLES = ['f_Emissions_Summary', 'f_Water_Data', 'f_Waste_Detailed']
+
+# Gemensam layout för alla PDF-sidor: (kolumnbredder, radhöjd, teckensnitt)
+PDF_METRIC_COLUMNS = (100, 50, 30)
+PDF_ROW_HEIGHT = 10
+PDF_FONT = "Arial"
+
+def _year_sum(conn, table, column, year):
+    """SUM för ett rapportår (datumkolumnen 'date'); 0 om tabellen saknas."""
+    if column not in _table_columns(conn, table):
+        return 0
+    if year is None:
+        return conn.execute(f"SELECT COALESCE(SUM({column}), 0) FROM {table}").fetchone()[0]
+    return conn.execute(
+        f"SELECT COALESCE(SUM({column}), 0) FROM {table} WHERE date >= ? AND date < ?",
+        (f"{int(year):04d}-01-01", f"{int(year) + 1:04d}-01-01"),
+    ).fetchone()[0]
+
+def get_pdf_aggregates(conn, year=None):
+    """
+    PDF-underlaget från aggregat: scopes och Scope 3-kategorier ur
+    f_Emissions_Summary (samma Scope 3-definition som översikten) samt
+    vatten/avfall via SUM, utan att läsa in tabeller.
+    Args:
+        year (int, optional): Rapportår. Defaults to alla år.
+    Returns:
+        tuple: (summary_df med Category/Value/Unit, {Scope 3-kategori som ingår i totalen: kg CO2e}).
+    """
+    emissions_summary.ensure_summary(conn)
+    (scope1, scope2, scope3), counted = emissions_summary.get_scope_breakdown(conn, year)
+    scope3_details = {category: ton * 1000 for category, ton in sorted(counted.items())}
+
+    summary_df = pd.DataFrame({
+        "Category": ["Scope 1 (Direct)", "Scope 2 (Energy)", "Scope 3 (Value Chain)", "Total Water Consumption (m3)", "Total Waste (kg)"],
+        "Value": [
+            scope1 * 1000,
+            scope2 * 1000,
+            scope3 * 1000,
+            _year_sum(conn, 'f_Water_Data', 'consumption_m3', year),
+            _year_sum(conn, 'f_Waste_Detailed', 'weight_kg', year),
+        ],
+        "Unit": ["kg CO2e", "kg CO2e", "kg CO2e", "m3", "kg"]
+    })
+    return summary_df, scope3_details
 
-def generate_pdf_summary(summary_df: pd.DataFrame, scope3_details: dict = None) -> BytesIO:
+def generate_pdf_summary(summary_df: pd.DataFrame, scope3_details: dict = None, title: str = "CSRD Report Summary") -> BytesIO:
     """
     Generates a PDF summary of the CSRD report.
+    Cached on the content of the input, so an unchanged summary is not re-rendered.
     """
+    params = {"summary": summary_df.to_dict(orient="split"), "scope3": scope3_details or {}, "title": title}
+    path = artifact_cache.get_or_build(
+        "pdf_summary", [], lambda p: _render_pdf(p, [(title, summary_df, scope3_details)]), params=params, suffix=".pdf"
+    )
+    with open(path, 'rb') as f:
+        return BytesIO(f.read())
+
+def generate_year_pdf(year=None) -> BytesIO:
+    """
+    PDF-sammanfattning för ett rapportår direkt från aggregatfrågorna.
+    Args:
+        year (int, optional): Rapportår. Defaults to alla år.
+    """
+    with get_db_connection() as conn:
+        summary_df, scope3_details = get_pdf_aggregates(conn, year)
+    title = "CSRD Report Summary" if year is None else f"CSRD Report Summary {year}"
+    return generate_pdf_summary(summary_df, scope3_details, title)
+
+def generate_pdf_batch(years) -> BytesIO:
+    """
+    Sammanfattningar för flera rapportår i ett dokument (en sida per år).
+    Aggregaten hämtas för alla år i samma anslutning och dokumentet
+    cachas tills någon av källtabellerna ändras.
+    """
+    years = sorted({int(y) for y in years})
+
+    def build(path):
+        with get_db_connection() as conn:
+            pages = [(f"CSRD Report Summary {year}", *get_pdf_aggregates(conn, year)) for year in years]
+        _render_pdf(path, pages)
+
+    path = artifact_cache.get_or_build("pdf_batch", PDF_SOURCE_TABLES, build, params={"years": years}, suffix=".pdf")
+    with open(path, 'rb') as f:
+        return BytesIO(f.read())
+
+def _new_pdf():
+    """Dokument med den gemensamma layouten (teckensnitt, marginaler)."""
     pdf = FPDF()
+    pdf.set_auto_page_break(auto=True, margin=15)
+    pdf.set_font(PDF_FONT, size=12)
+    return pdf
+
+def _render_pdf(path, pages):
+    """Skriver en sida per (titel, summary_df, scope3_details) i samma dokument."""
+    pdf = _new_pdf()
+    for title, summary_df, scope3_details in pages:
+        _draw_summary_page(pdf, summary_df, scope3_details, title)
+    pdf.output(path)
+
+def _draw_summary_page(pdf, summary_df, scope3_details=None, title="CSRD Report Summary"):
+    metric_w, value_w, unit_w = PDF_METRIC_COLUMNS
+    h = PDF_ROW_HEIGHT
+
     pdf.add_page()
-    pdf.set_font("Arial", size=12)
+    pdf.set_font(PDF_FONT, size=12)
     
-    pdf.cell(200, 10, txt="CSRD Report Summary", ln=True, align="C")
+    pdf.cell(200, h, txt=title, ln=True, align="C")
     pdf.ln(10)
 
     # --- Main Scopes Table ---
-    pdf.set_font("Arial", style='B', size=11)
-    pdf.cell(200, 10, "Environmental Key Metrics", ln=True)
+    pdf.set_font(PDF_FONT, style='B', size=11)
+    pdf.cell(200, h, "Environmental Key Metrics", ln=True)
     
-    pdf.set_font("Arial", style='B', size=10)
-    pdf.cell(100, 10, "Metric", 1)
-    pdf.cell(50, 10, "Value", 1)
-    pdf.cell(30, 10, "Unit", 1, ln=True)
+    pdf.set_font(PDF_FONT, style='B', size=10)
+    pdf.cell(metric_w, h, "Metric", 1)
+    pdf.cell(value_w, h, "Value", 1)
+    pdf.cell(unit_w, h, "Unit", 1, ln=True)
     
-    pdf.set_font("Arial", size=10)
+    pdf.set_font(PDF_FONT, size=10)
     # Using the new summary structure if passed, or default
     if "Category" in summary_df.columns:
-         for index, row in summary_df.iterrows():
-            pdf.cell(100, 10, str(row["Category"]), 1)
-            pdf.cell(50, 10, f"{row['Value']:.2f}", 1)
-            pdf.cell(30, 10, str(row['Unit']), 1, ln=True)
+        for category, value, unit in summary_df[["Category", "Value", "Unit"]].itertuples(index=False):
+            pdf.cell(metric_w, h, str(category), 1)
+            pdf.cell(value_w, h, f"{value:.2f}", 1)
+            pdf.cell(unit_w, h, str(unit), 1, ln=True)
     else:
         # Fallback for old dataframe structure
-        for index, row in summary_df.iterrows():
-            pdf.cell(100, 10, str(row["Scope"]), 1)
-            pdf.cell(50, 10, f"{row['Total CO2e (kg)']:.2f}", 1)
-            pdf.cell(30, 10, "kg CO2e", 1, ln=True)
+        for scope, value in summary_df[["Scope", "Total CO2e (kg)"]].itertuples(index=False):
+            pdf.cell(metric_w, h, str(scope), 1)
+            pdf.cell(value_w, h, f"{value:.2f}", 1)
+            pdf.cell(unit_w, h, "kg CO2e", 1, ln=True)
 
     # --- Scope 3 Breakdown ---
     if scope3_details:
         pdf.ln(10)
-        pdf.set_font("Arial", style='B', size=11)
-        pdf.cell(200, 10, "Scope 3 Breakdown", ln=True)
+        pdf.set_font(PDF_FONT, style='B', size=11)
+        pdf.cell(200, h, "Scope 3 Breakdown", ln=True)
         
-        pdf.set_font("Arial", style='B', size=10)
-        pdf.cell(100, 10, "Category", 1)
-        pdf.cell(50, 10, "Total CO2e (kg)", 1, ln=True)
+        pdf.set_font(PDF_FONT, style='B', size=10)
+        pdf.cell(metric_w, h, "Category", 1)
+        pdf.cell(value_w, h, "Total CO2e (kg)", 1, ln=True)
         
-        pdf.set_font("Arial", size=10)
+        pdf.set_font(PDF_FONT, size=10)
         for category, value in scope3_details.items():
-            pdf.cell(100, 10, str(category), 1)
-            pdf.cell(50, 10, f"{value:.2f}", 1, ln=True)
+            pdf.cell(metric_w, h, str(category), 1)
+            pdf.cell(value_w, h, f"{value:.2f}", 1, ln=True)
 
     pdf.ln(20)
-    pdf.set_font("Arial", style='I', size=8)
-    pdf.cell(200, 10, txt="Generated via ESG Tool - Strategic Sustainability Management", ln=True, align="C")
-
-    pdf_output = BytesIO()
-    pdf.output(pdf_output)
-    pdf_output.seek(0)
-    return pdf_output
\ No newline at end of file
+    pdf.set_font(PDF_FONT, style='I', size=8)
+    pdf.cell(200, h, txt="Generated via ESG Tool - Strategic Sustainability Management", ln=True, align="C")
@@ -0,0 +1,190 @@
+"""
+Background report generation.
+
+Exports are submitted as jobs and built in a separate worker process, so
+the Streamlit script thread returns immediately and several users can
+generate large reports at the same time. Each job is a row in
+system_report_jobs (status, progress, artifact path); the Export page polls
+that row and offers the download when the job is done. Artifacts live in
+the artifact cache, so a request for an unchanged report completes at once.
+"""
+import json
+import uuid
+from datetime import date
+
+from modules import db
+from modules import artifact_cache
+from modules import export_excel
+from modules import migrations
+from modules import report_csrd
+from modules.worker_pool import WorkerPool
+
+MAX_WORKERS = 2
+
+
+# Statusvärden i system_report_jobs
+QUEUED, RUNNING, DONE, FAILED = "queued", "running", "done", "failed"
+
+_workers = WorkerPool(MAX_WORKERS)
+
+
+def ensure_jobs_table(conn):
+    """Skapar system_report_jobs (idempotent, hoppas över om schemat är aktuellt)."""
+    if migrations.is_current(conn):
+        return
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS system_report_jobs (
+            job_id TEXT PRIMARY KEY,
+            kind TEXT NOT NULL,
+            params TEXT,
+            status TEXT NOT NULL,
+            progress REAL DEFAULT 0,
+            artifact_path TEXT,
+            file_name TEXT,
+            error TEXT,
+            created_at TEXT DEFAULT CURRENT_TIMESTAMP,
+            updated_at TEXT DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+    conn.commit()
+
+
+def _update_job(job_id, db_path=None, **fields):
+    columns = ", ".join(f"{name} = ?" for name in fields)
+    with db.get_conn(db_path) as conn:
+        conn.execute(
+            f"UPDATE system_report_jobs SET {columns}, updated_at = CURRENT_TIMESTAMP WHERE job_id = ?",
+            (*fields.values(), job_id),
+        )
+        conn.commit()
+
+
+# --- Jobbtyper (körs i arbetsprocessen) ---
+
+def _build_csrd_excel(path, progress, db_path):
+    report_csrd.write_csrd_report(path, progress=progress, db_path=db_path)
+
+
+def _build_audit_excel(path, progress, db_path, year):
+    with db.get_conn(db_path) as conn:
+        if export_excel.create_audit_excel(conn, year, path, progress=progress) is None:
+            raise RuntimeError("Revisionsexporten kunde inte skapas.")
+
+
+# Jobbtyp -> (byggfunktion, filnamnsmall för nedladdningen, källtabeller)
+JOB_KINDS = {
+    "csrd_excel": (_build_csrd_excel, "CSRD_Report_{date}.xlsx", report_csrd.SOURCE_TABLES),
+    "audit_excel": (_build_audit_excel, "ESG_Audit_{year}.xlsx", list(export_excel.AUDIT_TABLES)),
+}
+
+
+def _run_job(job_id, kind, params, db_path):
+    """Kör ett jobb i arbetsprocessen och för status/progress till jobbtabellen i db_path."""
+    build, _, tables = JOB_KINDS[kind]
+    progress = lambda share: _update_job(job_id, db_path, progress=round(share, 3))
+
+    _update_job(job_id, db_path, status=RUNNING, progress=0.0)
+    try:
+        path = artifact_cache.get_or_build(
+            kind, tables, lambda p: build(p, progress, db_path, **params), params=params, suffix=".xlsx", db_path=db_path
+        )
+    except Exception as e:
+        _update_job(job_id, db_path, status=FAILED, error=str(e))
+        return
+    _update_job(job_id, db_path, status=DONE, progress=1.0, artifact_path=path)
+
+
+def _on_done(job_id, future):
+    # Fångar fel som aldrig nådde jobbtabellen (t.ex. en krashad arbetsprocess)
+    error = future.exception()
+    if error is not None:
+        _update_job(job_id, status=FAILED, error=str(error))
+
+
+def submit(kind, **params):
+    """
+    Lägger ett exportjobb i kö.
+    Args:
+        kind (str): Nyckel i JOB_KINDS, t.ex. 'csrd_excel' eller 'audit_excel'.
+        **params: Parametrar till byggfunktionen (JSON-serialiserbara), t.ex. year.
+    Returns:
+        str: Jobbets id.
+    """
+    if kind not in JOB_KINDS:
+        raise ValueError(f"Okänd jobbtyp: {kind}")
+
+    job_id = uuid.uuid4().hex
+    _, name_template, tables = JOB_KINDS[kind]
+    file_name = name_template.format(date=date.today().isoformat(), **params)
+
+    # Oförändrade källtabeller: artefakten finns redan, inget behöver byggas
+    cached_path = artifact_cache.lookup(kind, tables, params, suffix=".xlsx")
+
+    with db.get_conn() as conn:
+        ensure_jobs_table(conn)
+        if cached_path:
+            conn.execute(
+                "INSERT INTO system_report_jobs (job_id, kind, params, status, progress, artifact_path, file_name) VALUES (?, ?, ?, ?, 1.0, ?, ?)",
+                (job_id, kind, json.dumps(params), DONE, cached_path, file_name),
+            )
+        else:
+            conn.execute(
+                "INSERT INTO system_report_jobs (job_id, kind, params, status, file_name) VALUES (?, ?, ?, ?, ?)",
+                (job_id, kind, json.dumps(params), QUEUED, file_name),
+            )
+        conn.commit()
+    if cached_path:
+        return job_id
+
+    future = _workers.submit(_run_job, job_id, kind, params, db.DB_PATH)
+    future.add_done_callback(lambda f: _on_done(job_id, f))
+    return job_id
+
+
+def get_job(job_id):
+    """
+    Status för ett jobb.
+    Returns:
+        dict | None: Jobbraden (status, progress, artifact_path, file_name, error ...).
+    """
+    with db.get_conn() as conn:
+        ensure_jobs_table(conn)
+        cursor = conn.execute("SELECT * FROM system_report_jobs WHERE job_id = ?", (job_id,))
+        row = cursor.fetchone()
+        if row is None:
+            return None
+        return dict(zip([d[0] for d in cursor.description], row))
+
+
+def list_jobs(limit=20):
+    """De senaste jobben, nyast först."""
+    with db.get_conn() as conn:
+        ensure_jobs_table(conn)
+        cursor = conn.execute("SELECT * FROM system_report_jobs ORDER BY created_at DESC, rowid DESC LIMIT ?", (limit,))
+        columns = [d[0] for d in cursor.description]
+        return [dict(zip(columns, row)) for row in cursor.fetchall()]
+
+
+def read_artifact(job_id):
+    """Innehållet i ett färdigt jobbs fil (bytes), None om det inte är klart eller har rensats ur cachen."""
+    job = get_job(job_id)
+    if job is None or job["status"] != DONE or not job["artifact_path"]:
+        return None
+    try:
+        with open(job["artifact_path"], "rb") as f:
+            return f.read()
+    except FileNotFoundError:
+        return None
+
+
+def purge_jobs(max_age_hours=24):
+    """Tar bort gamla jobbrader (filerna hanteras av artefaktcachen)."""
+    with db.get_conn() as conn:
+        ensure_jobs_table(conn)
+        old = conn.execute(
+            "SELECT job_id FROM system_report_jobs WHERE created_at < datetime('now', ?)",
+            (f"-{int(max_age_hours)} hours",),
+        ).fetchall()
+        conn.executemany("DELETE FROM system_report_jobs WHERE job_id = ?", old)
+        conn.commit()
+    return len(old)
@@ -1,6 +1,9 @@
-import pandas as pd
+from modules import db
+from modules import migrations
 
 def ensure_tables(conn):
+    if migrations.is_current(conn):
+        return # Skapad vid uppstart (init_db)
     conn.execute("""
         CREATE TABLE IF NOT EXISTS f_Drivmedel (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -13,34 +16,50 @@ def ensure_tables(conn):
     """)
     conn.commit()
 
+# Schablonvärden kg CO2e per liter (WTW - Well to Wheel om möjligt, annars TTW)
+# Exempelvärden baserade på drivmedelsförordningen/Naturvårdsverket
+EMISSION_FACTORS = {
+    'Diesel (MK1)': 2.54,
+    'Diesel (HVO100)': 0.35, # Varierar kraftigt beroende på råvara, sätter konservativt
+    'Bensin (95)': 2.36,
+    'Bensin (98)': 2.40,
+    'E85': 1.65, # Genomsnitt
+    'Biogas': 0.6 # kg/Nm3 ca
+}
+DEFAULT_FACTOR = 2.5
+
 def get_emission_factor(drivmedel):
-    # Schablonvärden kg CO2e per liter (WTW - Well to Wheel om möjligt, annars TTW)
-    # Exempelvärden baserade på drivmedelsförordningen/Naturvårdsverket
-    faktorer = {
-        'Diesel (MK1)': 2.54,
-        'Diesel (HVO100)': 0.35, # Varierar kraftigt beroende på råvara, sätter konservativt
-        'Bensin (95)': 2.36,
-        'Bensin (98)': 2.40,
-        'E85': 1.65, # Genomsnitt
-        'Biogas': 0.6 # kg/Nm3 ca
-    }
-    return faktorer.get(drivmedel, 2.5)
+    return EMISSION_FACTORS.get(drivmedel, DEFAULT_FACTOR)
 
 def recalculate_all(conn):
+    """
+    Räknar om co2_kg för alla tankningar i en enda UPDATE.
+    Faktorerna laddas i en temporär tabell och joinas in, okända
+    drivmedel får DEFAULT_FACTOR.
+    """
     ensure_tables(conn)
-    
+    _recalculate(conn)
+
+def recalculate_rows(conn, ids):
+    """
+    Räknar om co2_kg för enbart de angivna raderna (inkrementell omräkning).
+    """
+    db.load_temp_table(conn, "tmp_scope1_ids", ["id INTEGER PRIMARY KEY"], [(i,) for i in ids])
+    _recalculate(conn, "WHERE id IN (SELECT id FROM temp.tmp_scope1_ids)")
+
+def _recalculate(conn, where=""):
     try:
-        df = pd.read_sql("SELECT * FROM f_Drivmedel", conn)
-        
-        updates = []
-        for _, row in df.iterrows():
-            faktor = get_emission_factor(row['drivmedelstyp'])
-            new_co2 = row['volym_liter'] * faktor
-            updates.append((new_co2, row['id']))
-            
-        if updates:
-            conn.executemany("UPDATE f_Drivmedel SET co2_kg = ? WHERE id = ?", updates)
-            conn.commit()
+        db.load_temp_table(conn, "tmp_scope1_factors",
+                           ["drivmedelstyp TEXT PRIMARY KEY", "faktor REAL"],
+                           EMISSION_FACTORS.items())
+        conn.execute(f"""
+            UPDATE f_Drivmedel
+            SET co2_kg = volym_liter * COALESCE(
+                (SELECT f.faktor FROM temp.tmp_scope1_factors f
+                 WHERE f.drivmedelstyp = f_Drivmedel.drivmedelstyp), ?)
+            {where}
+        """, (DEFAULT_FACTOR,))
+        conn.commit()
             
     except Exception as e:
         print(f"Scope 1 Recalculation Error: {e}")
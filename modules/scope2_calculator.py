@@ -1,6 +1,11 @@
-import pandas as pd
+from modules import db
+from modules import migrations
+
+DISTRICT_HEATING_FACTOR = 0.060 # 60g/kWh schablon fjärrvärme (även för market based om ej specat)
 
 def ensure_tables(conn):
+    if migrations.is_current(conn):
+        return # Skapad vid uppstart (init_db)
     conn.execute("""
         CREATE TABLE IF NOT EXISTS f_Energi (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -33,30 +38,40 @@ def get_market_based_factor(source):
         return 0.350
 
 def recalculate_all(conn):
+    """
+    Räknar om Scope 2 (location- och market-based) i en enda UPDATE ... FROM.
+    Faktorerna materialiseras per år resp. elkälla som finns i f_Energi,
+    så get_grid_mix_factor/get_market_based_factor anropas en gång per
+    distinkt värde i stället för en gång per rad.
+    """
     ensure_tables(conn)
-    
+    _recalculate(conn)
+
+def recalculate_rows(conn, ids):
+    """
+    Räknar om Scope 2 för enbart de angivna raderna (inkrementell omräkning).
+    """
+    db.load_temp_table(conn, "tmp_scope2_ids", ["id INTEGER PRIMARY KEY"], [(i,) for i in ids])
+    _recalculate(conn, "id IN (SELECT id FROM temp.tmp_scope2_ids)")
+
+def _recalculate(conn, condition="1"):
     try:
-        df = pd.read_sql("SELECT * FROM f_Energi", conn)
+        years = [r[0] for r in conn.execute(f"SELECT DISTINCT ar FROM f_Energi WHERE {condition}")]
+        sources = [r[0] for r in conn.execute(f"SELECT DISTINCT el_kalla FROM f_Energi WHERE {condition}")]
         
-        updates = []
-        for _, row in df.iterrows():
-            # Location based (Svensk medel)
-            loc_factor = get_grid_mix_factor(row['ar'])
-            loc_co2 = (row['el_kwh'] * loc_factor) + (row['fjarrvarme_kwh'] * 0.060) # 60g/kWh schablon fjärrvärme
-            
-            # Market based (Avtal)
-            mark_factor = get_market_based_factor(row['el_kalla'])
-            mark_co2 = (row['el_kwh'] * mark_factor) + (row['fjarrvarme_kwh'] * 0.060) # Antar mix för fjärrvärme om ej specat
-            
-            updates.append((loc_co2, mark_co2, row['id']))
-            
-        if updates:
-            conn.executemany("""
-                UPDATE f_Energi 
-                SET scope2_location_based_kg = ?, scope2_market_based_kg = ? 
-                WHERE id = ?
-            """, updates)
-            conn.commit()
+        db.load_temp_table(conn, "tmp_scope2_grid", ["ar INTEGER", "faktor REAL"],
+                           [(ar, get_grid_mix_factor(ar)) for ar in years])
+        db.load_temp_table(conn, "tmp_scope2_market", ["el_kalla TEXT", "faktor REAL"],
+                           [(src, get_market_based_factor(src)) for src in sources])
+        
+        conn.execute(f"""
+            UPDATE f_Energi
+            SET scope2_location_based_kg = f_Energi.el_kwh * g.faktor + f_Energi.fjarrvarme_kwh * :fjv,
+                scope2_market_based_kg = f_Energi.el_kwh * m.faktor + f_Energi.fjarrvarme_kwh * :fjv
+            FROM temp.tmp_scope2_grid g, temp.tmp_scope2_market m
+            WHERE g.ar IS f_Energi.ar AND m.el_kalla IS f_Energi.el_kalla AND {condition}
+        """, {"fjv": DISTRICT_HEATING_FACTOR})
+        conn.commit()
             
     except Exception as e:
         print(f"Scope 2 Recalculation Error: {e}")
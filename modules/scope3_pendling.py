@@ -1,54 +1,81 @@
+import numpy as np
 import pandas as pd
 from datetime import datetime, timedelta
-from modules.distance_api import get_distance
+from modules.distance_api import get_distances
 
-def calculate_emissions(distans_km, start, slut, dagar_vecka, fardmedel):
+# Emissionsfaktorer (kg CO2/km)
+EMISSION_FACTORS = {
+    'Bil': 0.12,
+    'Elbil': 0.02,
+    'Buss': 0.04,
+    'Tåg': 0.006,
+    'Cykel': 0.0,
+    'Okänt': 0.08  # Schablon
+}
+DEFAULT_FACTOR = 0.08
+
+DISTANCE_MISSING = 'Distans saknas' # Datakvalitet för uppdrag utan känd distans
+
+def calculate_emissions_df(df):
     """
-    Beräknar CO2 för ett enskilt uppdrag
+    Beräknar CO2 för många uppdrag på en gång (vektoriserat).
+    Args:
+        df (pd.DataFrame): Kolumnerna distans_km, startdatum, slutdatum,
+            dagar_per_vecka och fardmedel.
+    Returns:
+        pd.DataFrame: Med samma index och kolumnerna antal_arbetsdagar,
+            total_km, total_co2_kg, datakvalitet och emissionsfaktor.
     """
+    start = pd.to_datetime(df['startdatum'], errors='coerce')
+    slut = pd.to_datetime(df['slutdatum'], errors='coerce')
+    dagar_vecka = pd.to_numeric(df['dagar_per_vecka'], errors='coerce')
+    distans = pd.to_numeric(df['distans_km'], errors='coerce').to_numpy(dtype=float)
+    fardmedel = df['fardmedel']
     
-    # Antal arbetsdagar
-    if pd.isna(start) or pd.isna(slut):
-        return {
-            'total_km': 0,
-            'total_co2_kg': 0,
-            'datakvalitet': 'Felaktig Data',
-            'emissionsfaktor': 0
-        }
-        
-    delta = (slut - start).days
-    veckor = delta / 7
-    arbetsdagar = int(veckor * dagar_vecka)
+    felaktig = (start.isna() | slut.isna() | dagar_vecka.isna()).to_numpy()
     
-    # Emissionsfaktorer (kg CO2/km)
-    faktorer = {
-        'Bil': 0.12,
-        'Elbil': 0.02,
-        'Buss': 0.04,
-        'Tåg': 0.006,
-        'Cykel': 0.0,
-        'Okänt': 0.08  # Schablon
-    }
+    # Antal arbetsdagar (trunkeras som int() i den tidigare radvisa beräkningen)
+    veckor = (slut - start).dt.days.to_numpy(dtype=float) / 7
+    arbetsdagar = np.where(felaktig, 0, np.trunc(np.nan_to_num(veckor * dagar_vecka.to_numpy(dtype=float))))
     
-    ef = faktorer.get(fardmedel, 0.08)
+    ef = fardmedel.map(EMISSION_FACTORS).fillna(DEFAULT_FACTOR).to_numpy(dtype=float)
+    ef = np.where(felaktig, 0.0, ef)
     
     # Beräkning
-    total_km = distans_km * 2 * arbetsdagar
+    total_km = distans * 2 * arbetsdagar
     co2_kg = total_km * ef
     
     # Datakvalitet
-    if fardmedel == 'Okänt':
-        kvalitet = 'Schablon'
-    elif fardmedel in faktorer:
-        kvalitet = 'Verifierad'
-    else:
-        kvalitet = 'Estimerad'
+    kvalitet = np.where(fardmedel == 'Okänt', 'Schablon',
+                        np.where(fardmedel.isin(list(EMISSION_FACTORS)), 'Verifierad', 'Estimerad'))
+    kvalitet = np.where(np.isnan(distans), DISTANCE_MISSING, kvalitet) # Distans kunde inte bestämmas; km/CO2 lämnas tomma
+    kvalitet = np.where(felaktig, 'Felaktig Data', kvalitet)
     
-    return {
+    return pd.DataFrame({
+        'antal_arbetsdagar': np.where(distans > 0, arbetsdagar, 0),
         'total_km': total_km,
         'total_co2_kg': co2_kg,
         'datakvalitet': kvalitet,
         'emissionsfaktor': ef
+    }, index=df.index)
+
+def calculate_emissions(distans_km, start, slut, dagar_vecka, fardmedel):
+    """
+    Beräknar CO2 för ett enskilt uppdrag (tunn wrapper kring calculate_emissions_df)
+    """
+    result = calculate_emissions_df(pd.DataFrame({
+        'distans_km': [distans_km],
+        'startdatum': [start],
+        'slutdatum': [slut],
+        'dagar_per_vecka': [dagar_vecka],
+        'fardmedel': [fardmedel]
+    })).iloc[0]
+    
+    return {
+        'total_km': float(result['total_km']),
+        'total_co2_kg': float(result['total_co2_kg']),
+        'datakvalitet': result['datakvalitet'],
+        'emissionsfaktor': float(result['emissionsfaktor'])
     }
 
 def calculate_all_consultants(conn):
@@ -72,56 +99,47 @@ def calculate_all_consultants(conn):
             FROM f_Uppdrag u
             JOIN d_Personal p ON u.person_id = p.person_id
             JOIN d_Kundsiter k ON u.kund_plats_id = k.kund_plats_id
-            WHERE u.uppdrag_id NOT IN (SELECT uppdrag_id FROM f_Pendling_Beraknad)
+            WHERE NOT EXISTS (SELECT 1 FROM f_Pendling_Beraknad b WHERE b.uppdrag_id = u.uppdrag_id)
         """, conn)
     except Exception as e:
         return {'error': str(e), 'antal_uppdrag': 0, 'total_co2_ton': 0, 'quality_breakdown': {}}
     
-    total_co2 = 0
-    quality_counts = {'Verifierad': 0, 'Estimerad': 0, 'Schablon': 0, 'Felaktig Data': 0}
-    
-    for _, row in uppdrag.iterrows():
-        # Hämta distans om saknas
-        if pd.isna(row['distans_km']):
-            distans = get_distance(row['hem_postnummer'], row['kund_postnummer'])
-        else:
-            distans = row['distans_km']
-        
-        # Beräkna
-        result = calculate_emissions(
-            distans,
-            pd.to_datetime(row['startdatum']),
-            pd.to_datetime(row['slutdatum']),
-            row['dagar_per_vecka'],
-            row['fardmedel']
+    # Hämta saknade distanser i ett svep: unika par löses parallellt (eller offline)
+    saknas = uppdrag['distans_km'].isna()
+    if saknas.any():
+        uppdrag.loc[saknas, 'distans_km'] = get_distances(
+            uppdrag.loc[saknas, 'hem_postnummer'].tolist(),
+            uppdrag.loc[saknas, 'kund_postnummer'].tolist()
         )
-        
-        # Spara i databas
-        try:
-            conn.execute("""
-                INSERT INTO f_Pendling_Beraknad 
-                (uppdrag_id, antal_arbetsdagar, total_km, emissionsfaktor_kg_per_km, totalt_co2_kg, datakvalitet)
-                VALUES (?, ?, ?, ?, ?, ?)
-            """, (
-                row['uppdrag_id'],
-                result['total_km'] / (distans * 2) if distans > 0 else 0,  # Återberäkna arbetsdagar
-                result['total_km'],
-                result['emissionsfaktor'],
-                result['total_co2_kg'],
-                result['datakvalitet']
-            ))
-            
-            total_co2 += result['total_co2_kg']
-            if result['datakvalitet'] in quality_counts:
-                quality_counts[result['datakvalitet']] += 1
-        except Exception as e:
-            print(f"Error saving calculation for uppdrag {row['uppdrag_id']}: {e}")
-            pass
     
-    conn.commit()
+    # Beräkna alla uppdrag vektoriserat
+    result = calculate_emissions_df(uppdrag)
+    
+    # Spara i databas, en transaktion för hela batchen
+    rows = zip(
+        uppdrag['uppdrag_id'].tolist(),
+        result['antal_arbetsdagar'].tolist(),
+        result['total_km'].tolist(),
+        result['emissionsfaktor'].tolist(),
+        result['total_co2_kg'].tolist(),
+        result['datakvalitet'].tolist()
+    )
+    try:
+        conn.executemany("""
+            INSERT INTO f_Pendling_Beraknad 
+            (uppdrag_id, antal_arbetsdagar, total_km, emissionsfaktor_kg_per_km, totalt_co2_kg, datakvalitet)
+            VALUES (?, ?, ?, ?, ?, ?)
+        """, rows)
+        conn.commit()
+    except Exception as e:
+        conn.rollback()
+        return {'error': str(e), 'antal_uppdrag': 0, 'total_co2_ton': 0, 'quality_breakdown': {}}
+    
+    quality_counts = {'Verifierad': 0, 'Estimerad': 0, 'Schablon': 0, 'Felaktig Data': 0, DISTANCE_MISSING: 0}
+    quality_counts.update(result['datakvalitet'].value_counts().to_dict())
     
     return {
         'antal_uppdrag': len(uppdrag),
-        'total_co2_ton': total_co2 / 1000,
+        'total_co2_ton': float(result['total_co2_kg'].sum()) / 1000,
         'quality_breakdown': quality_counts
-    }
\ No newline at end of file
+    }
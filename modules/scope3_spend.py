@@ -1,13 +1,9 @@
 import pandas as pd
-import streamlit as st
-import sqlite3
-import os
 from datetime import datetime
-
-def get_conn():
-    path = "database/esg_index.db"
-    if not os.path.exists(path) and os.path.exists(f"../{path}"): path = f"../{path}"
-    return sqlite3.connect(path)
+from modules.db import get_conn
+from modules import analytics
+from modules import snapshots
+from modules.query_cache import cached_query, invalidate
 
 EMISSION_FACTORS = {
     'IT-hårdvara (Laptops, Skärmar)': 0.045,
@@ -29,28 +25,63 @@ EMISSION_FACTORS = {
 
 def get_categories(): return list(EMISSION_FACTORS.keys())
 
-def add_spend_item(category, subcategory, product_name, spend_sek, period, quality='Estimated'):
+def _spend_row(category, subcategory, product_name, spend_sek, period, quality='Estimated'):
     factor = EMISSION_FACTORS.get(category, 0.010)
     co2 = (spend_sek * factor) / 1000.0
-    
+    return (category, subcategory, product_name, spend_sek, factor, co2, quality, period, datetime.now().strftime('%Y-%m-%d'))
+
+SPEND_INSERT = """
+    INSERT INTO f_Scope3_Calculations 
+    (category, subcategory, product_name, spend_sek, emission_factor, co2e_tonnes, data_quality, reporting_period, created_date)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+"""
+
+def add_spend_item(category, subcategory, product_name, spend_sek, period, quality='Estimated'):
+    row = _spend_row(category, subcategory, product_name, spend_sek, period, quality)
     with get_conn() as conn:
-        conn.execute("""
-            INSERT INTO f_Scope3_Calculations 
-            (category, subcategory, product_name, spend_sek, emission_factor, co2e_tonnes, data_quality, reporting_period, created_date)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
-        """, (category, subcategory, product_name, spend_sek, factor, co2, quality, period, datetime.now().strftime('%Y-%m-%d')))
+        conn.execute(SPEND_INSERT, row)
         conn.commit()
-    st.cache_data.clear()
-    return co2
+    invalidate('f_Scope3_Calculations')
+    return row[5]
 
-@st.cache_data(ttl=60)
-def get_spend_summary(period):
+def add_spend_items(items):
+    """
+    Adds many spend items in one transaction (one executemany, one commit).
+    Args:
+        items (iterable): Dicts with add_spend_item()'s argument names or
+            tuples in the same order.
+    Returns:
+        list: co2e_tonnes per item.
+    """
+    rows = [_spend_row(**item) if isinstance(item, dict) else _spend_row(*item) for item in items]
     with get_conn() as conn:
-        return pd.read_sql(f"SELECT category, SUM(spend_sek) as total_sek, SUM(co2e_tonnes) as total_co2 FROM f_Scope3_Calculations WHERE reporting_period = '{period}' GROUP BY category", conn)
+        conn.executemany(SPEND_INSERT, rows)
+        conn.commit()
+    invalidate('f_Scope3_Calculations')
+    return [row[5] for row in rows]
+
+def _period_snapshot(period, columns):
+    """Periodens rader ur Parquet-ögonblicksbilden, None om den inte är aktuell."""
+    df = snapshots.read_table('f_Scope3_Calculations', columns + ['reporting_period'], years=[snapshots.partition_for(period)])
+    if df is None:
+        return None
+    return df[df['reporting_period'] == str(period)]
 
-@st.cache_data(ttl=60)
+@cached_query(['f_Scope3_Calculations'])
+def get_spend_summary(period):
+    df = _period_snapshot(period, ['category', 'spend_sek', 'co2e_tonnes'])
+    if df is None:
+        return analytics.read_df("spend_summary", {"period": period})
+    summary = df.groupby('category', as_index=False, dropna=False)[['spend_sek', 'co2e_tonnes']].sum(min_count=1)
+    return summary.rename(columns={'spend_sek': 'total_sek', 'co2e_tonnes': 'total_co2'})
+
+@cached_query(['f_Scope3_Calculations'])
 def get_product_breakdown(period):
-    with get_conn() as conn:
-        try:
-            return pd.read_sql(f"SELECT product_name, category, SUM(co2e_tonnes) as co2 FROM f_Scope3_Calculations WHERE reporting_period = '{period}' AND product_name != '' GROUP BY product_name, category ORDER BY co2 DESC", conn)
-        except: return pd.DataFrame()
+    try:
+        df = _period_snapshot(period, ['product_name', 'category', 'co2e_tonnes'])
+        if df is None:
+            return analytics.read_df("product_breakdown", {"period": period})
+        df = df[df['product_name'].notna() & (df['product_name'] != '')]
+        breakdown = df.groupby(['product_name', 'category'], as_index=False, dropna=False)['co2e_tonnes'].sum(min_count=1)
+        return breakdown.rename(columns={'co2e_tonnes': 'co2'}).sort_values('co2', ascending=False, ignore_index=True)
+    except: return pd.DataFrame()
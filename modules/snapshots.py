@@ -0,0 +1,294 @@
+"""
+Columnar Parquet snapshots of the fact tables for analytical reads.
+
+Each table in SNAPSHOT_TABLES is exported to Parquet with one file per
+reporting year (<snapshots>/<table>/<build>/year=<YYYY>/part.parquet).
+Readers memory-map only the partitions and columns they need. Analytics
+therefore read immutable files and do not hold read transactions on the
+database the app writes to.
+
+A snapshot is current while the table's change counter and max rowid match
+the values recorded when it was built. The counter lives in
+system_table_versions and is kept by triggers from the schema migrations. Reading a
+stale or missing snapshot returns None, so the caller runs its own SQLite
+query, and starts a rebuild in a background thread. pyarrow is optional:
+without it every read uses SQLite.
+"""
+import json
+import os
+import shutil
+import threading
+import uuid
+
+import pandas as pd
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError: # Valfritt beroende: utan pyarrow läses allt från SQLite
+    pa = pq = None
+
+from modules import db
+
+# tabell -> SQL-uttryck för rapportåret (partitionsnyckel)
+SNAPSHOT_TABLES = {
+    'f_Scope3_Calculations': "substr(reporting_period, 1, 4)",
+    'f_Drivmedel': "strftime('%Y', datum)",
+    'f_Energi': "CAST(ar AS TEXT)",
+    'f_Scope3_BusinessTravel': "strftime('%Y', date)",
+    'f_Scope3_PurchasedGoodsServices': "strftime('%Y', date)",
+    'f_Water_Data': "strftime('%Y', date)",
+    'f_Waste_Detailed': "strftime('%Y', date)",
+}
+
+UNKNOWN_YEAR = "unknown" # Partition för rader utan giltigt år
+CHUNK_SIZE = 50000
+MANIFEST = "manifest.json"
+
+_manifest_lock = threading.Lock()
+_build_locks = {}
+_build_locks_lock = threading.Lock()
+_failed = {} # tabell -> tillstånd där senaste ombyggnaden misslyckades
+
+
+def available():
+    """True om pyarrow finns, dvs. ögonblicksbilder kan byggas och läsas."""
+    return pq is not None
+
+
+def snapshot_dir():
+    """Katalog för ögonblicksbilderna, bredvid databasen."""
+    return os.path.join(os.path.dirname(db.DB_PATH), "snapshots")
+
+
+def partition_for(value):
+    """Partitionen (rapportåret) som ett år-/periodvärde hamnar i, t.ex. '2024-Q1' -> '2024'."""
+    year = str(value)[:4]
+    return year if len(year) == 4 and year.isdigit() else UNKNOWN_YEAR
+
+
+def _load_manifest():
+    try:
+        with open(os.path.join(snapshot_dir(), MANIFEST), encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def _save_manifest(manifest):
+    os.makedirs(snapshot_dir(), exist_ok=True)
+    path = os.path.join(snapshot_dir(), MANIFEST)
+    tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f)
+    os.replace(tmp_path, path)
+
+
+def _state(conn, table):
+    """[ändringsräknare, max rowid] för tabellen, None om den saknas eller saknar räknare."""
+    try:
+        row = conn.execute("SELECT version FROM system_table_versions WHERE table_name = ?", (table,)).fetchone()
+        max_rowid = conn.execute(f"SELECT MAX(rowid) FROM {table}").fetchone()[0]
+    except Exception:
+        return None
+    if row is None:
+        return None
+    return [row[0], max_rowid]
+
+
+def _arrow_type(declared):
+    # Typaffinitet enligt SQLite:s regler för deklarerad kolumntyp
+    declared = (declared or "").upper()
+    if "INT" in declared:
+        return pa.int64()
+    if any(name in declared for name in ("REAL", "FLOA", "DOUB", "NUM", "DEC")):
+        return pa.float64()
+    return pa.string()
+
+
+def _to_arrow(rows, schema):
+    arrays = []
+    for field, values in zip(schema, zip(*rows)):
+        if pa.types.is_string(field.type):
+            values = [None if value is None else str(value) for value in values]
+        arrays.append(pa.array(values, type=field.type))
+    return pa.Table.from_arrays(arrays, schema=schema)
+
+
+def _export(conn, table):
+    """Skriver tabellen till en ny build-katalog, en Parquet-fil per år."""
+    columns = [(row[1], row[2]) for row in conn.execute(f"PRAGMA table_info({table})")]
+    schema = pa.schema([(name, _arrow_type(declared)) for name, declared in columns])
+    year = SNAPSHOT_TABLES[table]
+    build = f"{table}/{uuid.uuid4().hex}"
+    root = os.path.join(snapshot_dir(), build)
+
+    writers = {}
+    try:
+        cursor = conn.execute(f"""
+            SELECT CASE WHEN ({year}) GLOB '[0-9][0-9][0-9][0-9]' THEN ({year}) ELSE '{UNKNOWN_YEAR}' END, *
+            FROM {table}
+        """)
+        while True:
+            rows = cursor.fetchmany(CHUNK_SIZE)
+            if not rows:
+                break
+            by_year = {}
+            for row in rows:
+                by_year.setdefault(row[0], []).append(row[1:])
+            for partition, part in by_year.items():
+                writer = writers.get(partition)
+                if writer is None:
+                    directory = os.path.join(root, f"year={partition}")
+                    os.makedirs(directory, exist_ok=True)
+                    writer = writers[partition] = pq.ParquetWriter(os.path.join(directory, "part.parquet"), schema)
+                writer.write_table(_to_arrow(part, schema))
+    except Exception:
+        for writer in writers.values():
+            writer.close()
+        shutil.rmtree(root, ignore_errors=True)
+        raise
+    for writer in writers.values():
+        writer.close()
+    return {"build": build, "years": sorted(writers), "columns": [name for name, _ in columns]}
+
+
+def _build_lock(table):
+    with _build_locks_lock:
+        return _build_locks.setdefault(table, threading.Lock())
+
+
+def refresh(tables=None, force=False):
+    """
+    Bygger om de ögonblicksbilder som är inaktuella.
+    Args:
+        tables (list, optional): Tabeller att uppdatera. Defaults to alla i SNAPSHOT_TABLES.
+        force (bool): Bygg om även aktuella ögonblicksbilder.
+    Returns:
+        list: Tabellerna som byggdes om.
+    """
+    if not available():
+        return []
+    tables = list(SNAPSHOT_TABLES) if tables is None else tables
+    rebuilt = []
+    for table in tables:
+        with _build_lock(table):
+            with db.get_conn() as conn:
+                # Tillstånd och export i samma lästransaktion
+                own_transaction = not conn.in_transaction
+                if own_transaction:
+                    conn.execute("BEGIN")
+                try:
+                    state = _state(conn, table)
+                    entry = _load_manifest().get(table)
+                    if state is None or (not force and entry and entry["state"] == state):
+                        continue
+                    new_entry = dict(_export(conn, table), state=state)
+                finally:
+                    if own_transaction:
+                        conn.rollback()
+
+            with _manifest_lock:
+                manifest = _load_manifest()
+                old_entry = manifest.get(table)
+                manifest[table] = new_entry
+                _save_manifest(manifest)
+            if old_entry:
+                # Läsare som redan öppnat filerna behåller dem (POSIX); på Windows kan borttagningen misslyckas
+                shutil.rmtree(os.path.join(snapshot_dir(), old_entry["build"]), ignore_errors=True)
+            rebuilt.append(table)
+    return rebuilt
+
+
+def _refresh_in_background(table, state):
+    try:
+        refresh([table])
+    except Exception as e:
+        _failed[table] = state
+        print(f"Snapshot refresh failed for {table}: {e}")
+
+
+def refresh_async(table, state=None):
+    """
+    Startar en ombyggnad i en bakgrundstråd, om ingen redan pågår för tabellen.
+    En ombyggnad som misslyckats försöks inte igen förrän tabellen ändrats.
+    """
+    if not available() or _build_lock(table).locked():
+        return
+    if state is not None and _failed.get(table) == state:
+        return
+    threading.Thread(target=_refresh_in_background, args=(table, state), daemon=True).start()
+
+
+def _current_entry(table):
+    if not available() or table not in SNAPSHOT_TABLES:
+        return None
+    entry = _load_manifest().get(table)
+    with db.get_conn() as conn:
+        state = _state(conn, table)
+    if entry is None or state is None or entry["state"] != state:
+        refresh_async(table, state)
+        return None
+    return entry
+
+
+def _partition_path(entry, year):
+    return os.path.join(snapshot_dir(), entry["build"], f"year={year}", "part.parquet")
+
+
+def read_table(table, columns=None, years=None):
+    """
+    Läser en tabell ur den aktuella ögonblicksbilden.
+    Args:
+        table (str): Tabell i SNAPSHOT_TABLES.
+        columns (list, optional): Kolumner att läsa (övriga läses aldrig). Defaults to alla.
+        years (list, optional): Rapportår (partitioner) att läsa. Defaults to alla.
+    Returns:
+        pd.DataFrame | None: None om ögonblicksbilden saknas eller är inaktuell;
+            anroparen läser då från SQLite.
+    """
+    entry = _current_entry(table)
+    if entry is None:
+        return None
+    columns = list(entry["columns"]) if columns is None else list(columns)
+    wanted = entry["years"] if years is None else [year for year in entry["years"] if year in {str(y) for y in years}]
+    try:
+        frames = [
+            pq.read_table(_partition_path(entry, year), columns=columns, memory_map=True).to_pandas()
+            for year in wanted
+        ]
+    except OSError:
+        return None # Ersatt av en nyare build under läsningen
+    if not frames:
+        return pd.DataFrame(columns=columns)
+    return pd.concat(frames, ignore_index=True)
+
+
+def scan(table, chunk_size=CHUNK_SIZE):
+    """
+    Läser en hel tabell i block ur den aktuella ögonblicksbilden (för rapporter).
+    Returns:
+        tuple | None: (kolumnnamn, iterator över listor av rad-tupler), eller
+            None om ögonblicksbilden saknas eller är inaktuell.
+    """
+    entry = _current_entry(table)
+    if entry is None:
+        return None
+    try:
+        # Öppna alla filer direkt så att en samtidig ombyggnad inte kan ta bort dem under läsningen
+        files = [pq.ParquetFile(_partition_path(entry, year), memory_map=True) for year in entry["years"]]
+    except OSError:
+        return None
+
+    def chunks():
+        for parquet_file in files:
+            for batch in parquet_file.iter_batches(batch_size=chunk_size):
+                yield list(zip(*(column.to_pylist() for column in batch.columns)))
+
+    return list(entry["columns"]), chunks()
+
+
+def clear():
+    """Tar bort alla ögonblicksbilder."""
+    with _manifest_lock:
+        shutil.rmtree(snapshot_dir(), ignore_errors=True)
@@ -1,18 +1,12 @@
 import pandas as pd
-import streamlit as st
-import sqlite3
-import os
+from modules.db import get_conn
+from modules import queries
+from modules.query_cache import cached_query, invalidate
 
-def get_conn():
-    path = "database/esg_index.db"
-    if not os.path.exists(path) and os.path.exists(f"../{path}"): path = f"../{path}"
-    return sqlite3.connect(path)
-
-@st.cache_data(ttl=60)
+@cached_query(['f_HR_Arsdata'])
 def get_hr_summary(year):
     try:
-        with get_conn() as conn:
-            return pd.read_sql(f"SELECT * FROM f_HR_Arsdata WHERE ar = {year}", conn)
+        return queries.read_df("hr_summary", {"year": int(year)})
     except: return pd.DataFrame()
 
 def save_extended_hr_data(data):
@@ -33,4 +27,4 @@ def save_extended_hr_data(data):
             data.get('ledning_kvinnor', 0), data.get('ledning_man', 0)
         ))
         conn.commit()
-    st.cache_data.clear()
\ No newline at end of file
+    invalidate('f_HR_Arsdata')
\ No newline at end of file
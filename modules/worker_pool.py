@@ -0,0 +1,52 @@
+"""
+Spawn-based worker process pools.
+
+Background reports (report_jobs) and group consolidation (entities) run
+their work in separate processes. Workers are started with the spawn
+method so they never inherit the parent's pooled sqlite connections.
+Workers do not get a database path injected at start-up: module-level
+paths are resolved when a worker imports its modules, so every task
+function takes the database path it works on as an explicit argument.
+"""
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+
+class WorkerPool:
+    """Lazily started ProcessPoolExecutor that is replaced if it breaks."""
+
+    def __init__(self, max_workers):
+        self.max_workers = max_workers
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def get(self):
+        """Poolens executor; startas vid första anropet."""
+        with self._lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.max_workers,
+                    mp_context=multiprocessing.get_context("spawn"),
+                )
+            return self._executor
+
+    def reset(self):
+        """Släpper executorn (t.ex. en trasig pool); nästa get() startar en ny."""
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    def submit(self, fn, *args):
+        """
+        Som ProcessPoolExecutor.submit(). En pool vars arbetsprocess dött
+        ersätts och anropet görs om en gång.
+        """
+        try:
+            return self.get().submit(fn, *args)
+        except (BrokenProcessPool, RuntimeError):
+            # RuntimeError: poolen har stängts (t.ex. vid omladdning av appen)
+            self.reset()
+            return self.get().submit(fn, *args)
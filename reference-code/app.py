@@ -294,7 +294,7 @@ elif page == "Strategi (CSRD)":
     # Visualisering (Matris)
     import altair as alt
     try:
-        data = pd.read_sql(f"SELECT * FROM f_Vasentlighet WHERE ar={ar_strat}", conn)
+        data = pd.read_sql("SELECT * FROM f_Vasentlighet WHERE ar = ?", conn, params=(int(ar_strat),))
         
         if not data.empty:
             st.markdown("### Väsentlighetsmatris")
@@ -530,9 +530,9 @@ elif page == "Revisorvy":
                 vald = st.selectbox("Välj post", uppdrag['berakning_id'])
                 
                 if st.button("Visa detaljer"):
-                    details = pd.read_sql(f"""
-                        SELECT * FROM f_Pendling_Beraknad WHERE berakning_id = {vald}
-                    """, conn)
+                    details = pd.read_sql("""
+                        SELECT * FROM f_Pendling_Beraknad WHERE berakning_id = ?
+                    """, conn, params=(int(vald),))
                     
                     st.json(details.to_dict(orient='records')[0])
                     
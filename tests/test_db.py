@@ -0,0 +1,90 @@
+"""
+Transaction semantics of the pooled connections in modules/db.py.
+"""
+import os
+import shutil
+
+import pytest
+
+from modules import db
+from modules import scope3_spend
+
+REPO_DB = os.path.join(os.path.dirname(__file__), "..", "database", "esg_index.db")
+
+
+@pytest.fixture
+def db_path(tmp_path, monkeypatch):
+    path = str(tmp_path / "esg_index.db")
+    shutil.copy(REPO_DB, path)
+    monkeypatch.setattr(db, "DB_PATH", path)
+    yield path
+    db.get_pool(path).close_all()
+
+
+def _water_rows(path):
+    with db.get_conn(path) as conn:
+        return conn.execute("SELECT COUNT(*) FROM f_Water_Data WHERE date = '2030-01-01'").fetchone()[0]
+
+
+def _insert_water(conn):
+    conn.execute("INSERT INTO f_Water_Data (date, consumption_m3) VALUES ('2030-01-01', 1)")
+
+
+def test_nested_block_does_not_commit_outer_transaction(db_path):
+    with pytest.raises(RuntimeError):
+        with db.get_conn() as conn:
+            _insert_water(conn)
+            with db.get_conn() as inner:
+                inner.execute("SELECT 1").fetchall()
+            raise RuntimeError
+
+    assert _water_rows(db_path) == 0
+
+
+def test_nested_write_commits_with_outer_block(db_path):
+    with db.get_conn():
+        with db.get_conn() as inner:
+            _insert_water(inner)
+
+    assert _water_rows(db_path) == 1
+
+
+def _spend_rows(path):
+    with db.get_conn(path) as conn:
+        return conn.execute("SELECT COUNT(*) FROM f_Scope3_Calculations WHERE reporting_period = '2030'").fetchone()[0]
+
+
+def _add_items(count):
+    for i in range(count):
+        scope3_spend.add_spend_item('IT-hårdvara', '', f'Produkt {i}', 1000, '2030')
+
+
+def test_unit_of_work_commits_once(db_path):
+    statements = []
+    with db.unit_of_work() as conn:
+        conn.set_trace_callback(statements.append)
+        _add_items(5)
+    conn.set_trace_callback(None)
+
+    # add_spend_item() commits per row on its own; in a unit only the exit commits
+    assert [s.strip().upper() for s in statements].count("COMMIT") == 1
+    assert _spend_rows(db_path) == 5
+
+
+def test_unit_of_work_rolls_back_on_exception(db_path):
+    with pytest.raises(RuntimeError):
+        with db.unit_of_work():
+            _add_items(5)
+            raise RuntimeError
+
+    assert _spend_rows(db_path) == 0
+
+
+def test_rollback_inside_unit_prevents_commit(db_path):
+    with pytest.raises(db.UnitRolledBack):
+        with db.unit_of_work() as conn:
+            _add_items(2)
+            conn.rollback()
+            _add_items(1)
+
+    assert _spend_rows(db_path) == 0
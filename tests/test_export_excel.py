@@ -0,0 +1,39 @@
+"""
+The audit export may skip tables that do not exist, but must never drop an
+existing table silently because its year filter no longer matches.
+"""
+import io
+import os
+import shutil
+import sqlite3
+
+import openpyxl
+import pytest
+
+from modules import export_excel
+
+REPO_DB = os.path.join(os.path.dirname(__file__), "..", "database", "esg_index.db")
+
+
+@pytest.fixture
+def conn(tmp_path):
+    path = tmp_path / "esg_index.db"
+    shutil.copy(REPO_DB, path)
+    conn = sqlite3.connect(path)
+    yield conn
+    conn.close()
+
+
+def test_missing_table_is_skipped(conn, monkeypatch):
+    monkeypatch.setitem(export_excel.AUDIT_TABLES, "f_Finns_Inte", "ar = :year")
+
+    output = export_excel.create_audit_excel(conn, 2024, io.BytesIO())
+
+    assert "f_Finns_Inte" not in openpyxl.load_workbook(output).sheetnames
+
+
+def test_bad_year_filter_fails_the_export(conn, monkeypatch):
+    monkeypatch.setitem(export_excel.AUDIT_TABLES, "f_Uppdrag", "omdopt_datum >= :start")
+
+    with pytest.raises(sqlite3.OperationalError, match="f_Uppdrag"):
+        export_excel.create_audit_excel(conn, 2024, io.BytesIO())
@@ -0,0 +1,62 @@
+"""
+The overview, the PDF summary and the Excel summary must report the same
+scope totals, in particular the same Scope 3 definition
+(emissions_summary.SCOPE3_PRIMARY with fallback to the other categories).
+"""
+import os
+import shutil
+import sqlite3
+
+import pytest
+
+from modules import emissions_summary
+from modules import report_csrd
+
+REPO_DB = os.path.join(os.path.dirname(__file__), "..", "database", "esg_index.db")
+SCOPE_ROWS = ["Scope 1 (Direct)", "Scope 2 (Energy)", "Scope 3 (Value Chain)"]
+
+
+@pytest.fixture
+def conn(tmp_path):
+    path = tmp_path / "esg_index.db"
+    shutil.copy(REPO_DB, path)
+    conn = sqlite3.connect(path)
+    emissions_summary.ensure_summary(conn)
+    # 2030: både spend-rader och aktivitetsdata (spend ska gälla)
+    conn.execute("INSERT INTO f_Scope3_Calculations (category, spend_sek, emission_factor, co2e_tonnes, reporting_period) "
+                 "VALUES ('IT-hårdvara', 1000, 0.02, 0.02, '2030')")
+    conn.execute("INSERT INTO f_Scope3_BusinessTravel (date, travel_type, distance_km, co2_kg) "
+                 "VALUES ('2030-03-01', 'Flyg', 1000, 500)")
+    # 2031: bara aktivitetsdata (summan av övriga kategorier ska gälla)
+    conn.execute("INSERT INTO f_Scope3_BusinessTravel (date, travel_type, distance_km, co2_kg) "
+                 "VALUES ('2031-03-01', 'Flyg', 500, 250)")
+    conn.commit()
+    yield conn
+    conn.close()
+
+
+def _scope_values(summary_df):
+    return summary_df.set_index("Category").loc[SCOPE_ROWS, "Value"].tolist()
+
+
+def _overview_kg(conn, period=None):
+    return [ton * 1000 for ton in emissions_summary.get_scope_totals(conn, period)]
+
+
+@pytest.mark.parametrize("year, scope3_kg", [(2030, 20.0), (2031, 250.0)])
+def test_pdf_matches_overview_per_year(conn, year, scope3_kg):
+    summary_df, scope3_details = report_csrd.get_pdf_aggregates(conn, year)
+    overview = _overview_kg(conn, year)
+
+    assert _scope_values(summary_df) == pytest.approx(overview)
+    assert overview[2] == pytest.approx(scope3_kg)
+    assert sum(scope3_details.values()) == pytest.approx(scope3_kg)
+
+
+def test_pdf_excel_and_overview_totals_match(conn):
+    pdf_df, _ = report_csrd.get_pdf_aggregates(conn)
+    excel_df = report_csrd.get_report_summary(conn)
+    overview = _overview_kg(conn)
+
+    assert _scope_values(pdf_df) == pytest.approx(overview)
+    assert _scope_values(excel_df) == pytest.approx(overview)